@@ -0,0 +1,146 @@
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+import datasets
+import evaluation
+import experiments
+import id3
+
+# == benchmarks ==
+# Each benchmark times one kind of work on a synthetic dataset.  They all take the following parameters:
+#     datasetConfig - the encoded synthetic DatasetConfiguration
+#     paramConfig - a freshly seeded ID3Configuration with the maxDepth of the grid point
+#     datasetName - the name the dataset is registered under in experiments, for end to end iterations
+# and return a function with no parameters that does the timed work once.
+
+def _benchmarkID3(datasetConfig, paramConfig, datasetName):
+    return lambda: id3.trainID3(datasetConfig)
+
+def _benchmarkDPID3(datasetConfig, paramConfig, datasetName):
+    return lambda: id3.trainDPID3(datasetConfig, paramConfig.maxDepth, paramConfig.epsilon, noiseSource=paramConfig.noiseSource)
+
+def _benchmarkBetterDPID3(datasetConfig, paramConfig, datasetName):
+    return lambda: id3.trainBetterDPID3(datasetConfig, paramConfig)
+
+def _benchmarkEvaluation(datasetConfig, paramConfig, datasetName):
+    # Only the evaluation of an already trained tree is timed.
+    tree = id3.trainBetterDPID3(datasetConfig, paramConfig)
+    return lambda: evaluation.evaluateDecisionTree(tree, datasetConfig)
+
+def _benchmarkIteration(datasetConfig, paramConfig, datasetName):
+    arguments = argparse.Namespace(maxDepth=str(paramConfig.maxDepth), epsilon=str(paramConfig.epsilon), mValue=str(paramConfig.mValue),
+                                   aProportion=str(paramConfig.aProportion), layerFunction=paramConfig.layerFunction.__name__)
+    job = experiments.IterationJob(datasetName, arguments, np.random.SeedSequence(0))
+    return lambda: experiments.runIteration(job)
+
+benchmarks = {
+    "ID3": _benchmarkID3,
+    "DP_ID3": _benchmarkDPID3,
+    "better_DP_ID3": _benchmarkBetterDPID3,
+    "evaluation": _benchmarkEvaluation,
+    "iteration": _benchmarkIteration
+}
+
+# ID3 grows the whole tree, so it is only timed once for each dataset instead of once per maxDepth.
+_ignoresMaxDepth = {"ID3"}
+
+def timeFunction(function, repeats):
+    '''
+    Time a function several times.
+
+    Parameters:
+        function - A function with no parameters
+        repeats - The number of times to call it
+    Returns:
+        A list with the wall time of each call in seconds
+    '''
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+def runBenchmarks(args):
+    '''
+    Time every benchmark in args.benchmark at every point of the grid of rows, attributes and maxDepth.
+
+    Parameters:
+        args - The parsed command line arguments of this script
+    Returns:
+        A generator that yields one result dictionary per benchmark and grid point
+    '''
+
+    for numRows in args.rows:
+        for numAttributes in args.attributes:
+            datasetConfig = datasets.makeSyntheticDataset(numRows, numAttributes, args.arity, args.classes, args.labelNoise, args.seed)
+            datasetName = f"synthetic-{numRows}-{numAttributes}"
+            experiments.registerDataset(datasetName, datasetConfig)
+            try:
+                for benchmarkName in args.benchmark:
+                    depths = [None] if benchmarkName in _ignoresMaxDepth else args.maxDepth
+                    for maxDepth in depths:
+                        paramConfig = id3.ID3Configuration(rng=np.random.default_rng(args.seed))
+                        paramConfig.maxDepth = maxDepth if maxDepth is not None else paramConfig.maxDepth
+                        paramConfig.epsilon = args.epsilon
+                        times = timeFunction(benchmarks[benchmarkName](datasetConfig, paramConfig, datasetName), args.repeats)
+                        yield {
+                            "benchmark": benchmarkName,
+                            "rows": numRows,
+                            "attributes": numAttributes,
+                            "maxDepth": maxDepth,
+                            "arity": args.arity,
+                            "classes": args.classes,
+                            "labelNoise": args.labelNoise,
+                            "seconds": times,
+                            "bestSeconds": min(times),
+                            "medianSeconds": statistics.median(times),
+                            "rowsPerSecond": numRows / min(times) if min(times) > 0 else None,
+                        }
+            finally:
+                experiments.unregisterDataset(datasetName)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time training and evaluation on synthetic datasets of increasing size.")
+    parser.add_argument("-o", "--outputFile", default="benchmark.json", help="the file to write the results to in JSON format")
+    parser.add_argument("-b", "--benchmark", nargs="+", default=list(benchmarks.keys()), choices=benchmarks.keys(), help="the benchmarks to run")
+    parser.add_argument("--rows", nargs="+", type=lambda value: int(float(value)), default=[1000, 10000, 100000, 1000000], help="the numbers of rows to generate, such as 1e3 1e5 1e7")
+    parser.add_argument("--attributes", nargs="+", type=int, default=[10], help="the numbers of attributes to generate")
+    parser.add_argument("--maxDepth", nargs="+", type=int, default=[2, 4], help="the maximum depths of the trees")
+    parser.add_argument("--arity", type=int, default=4, help="the number of values of every attribute")
+    parser.add_argument("--classes", type=int, default=2, help="the number of classes")
+    parser.add_argument("--labelNoise", type=float, default=0.1, help="the proportion of rows with a random class")
+    parser.add_argument("--epsilon", type=float, default=1, help="the privacy budget of each tree")
+    parser.add_argument("--repeats", type=int, default=3, help="the number of times to time each benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the synthetic data and the noise")
+    args = parser.parse_args()
+
+    results = []
+    for result in runBenchmarks(args):
+        results.append(result)
+        print(f"{result['benchmark']}: rows={result['rows']} attributes={result['attributes']} maxDepth={result['maxDepth']} best={result['bestSeconds']:.4f}s")
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "parameters": vars(args),
+        "results": results,
+    }
+    with open(args.outputFile, "w") as file:
+        json.dump(report, file, indent=2)
+
+if __name__ == "__main__":
+    main()
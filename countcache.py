@@ -0,0 +1,94 @@
+from collections import OrderedDict
+import threading
+
+class PathCounts:
+    '''
+    The exact counts of the rows that follow one path from the root of a tree, that is, the rows that match a set of
+    attribute=value conditions.  They do not depend on the noise, so every tree that reaches the same path can reuse them.
+    Each part is filled in the first time a node on the path needs it.
+
+    numRows - the number of rows
+    classCounts - the number of rows of each class
+    valueCounts, valueClassCounts - the counts of countAttributeValueClasses over the remaining attributes and their listed values
+    labelCounts - for each remaining attribute, the number of rows with each of its value labels, listed or not
+    '''
+
+    def __init__(self, numRows):
+        self.numRows = numRows
+        self.classCounts = None
+        self.valueCounts = None
+        self.valueClassCounts = None
+        self.labelCounts = None
+
+class CountCache:
+    '''
+    A bounded cache of PathCounts that evicts the least recently used path first.
+
+    A cache only holds the counts of one dataset and one set of training rows.  Use scoped() to share a single
+    bounded cache between several of them.
+
+    maxEntries - the largest number of paths to keep
+    hits, misses - the number of lookups that found a path and that did not
+
+    The cache can be shared by the threads of a parallel.trainParallel call.
+    '''
+
+    def __init__(self, maxEntries=100000):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        '''
+        Returns the PathCounts of a path, or None if they are not in the cache.
+
+        Parameters:
+            path - a frozenset of (column, valueCode) conditions
+        '''
+        with self.lock:
+            pathCounts = self.entries.get(path)
+            if pathCounts is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return pathCounts
+
+    def put(self, path, pathCounts):
+        '''
+        Adds the PathCounts of a path, evicting the least recently used paths if the cache is full.
+        '''
+        with self.lock:
+            self.entries[path] = pathCounts
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+    def removeWhere(self, condition):
+        '''
+        Removes every path for which condition(path) is True.
+        '''
+        with self.lock:
+            for path in [ path for path in self.entries if condition(path) ]:
+                del self.entries[path]
+
+    def scoped(self, scope):
+        '''
+        Returns a view of this cache for one dataset and set of training rows, identified by scope.
+        '''
+        return _ScopedCountCache(self, scope)
+
+class _ScopedCountCache:
+    # A view of a CountCache whose paths are all prefixed with a scope.
+
+    def __init__(self, cache, scope):
+        self.cache = cache
+        self.scope = scope
+
+    def get(self, path):
+        return self.cache.get((self.scope, path))
+
+    def put(self, path, pathCounts):
+        self.cache.put((self.scope, path), pathCounts)
@@ -0,0 +1,123 @@
+import numpy as np
+
+# The number of index cells the counting functions work on at a time.
+chunkCells = 1 << 20
+
+def indexDtype(numCells):
+    '''
+    Returns the smallest integer dtype that can index numCells cells.
+    '''
+    return np.int32 if numCells <= np.iinfo(np.int32).max else np.int64
+
+def countAttributeValueClasses(attributeCodes, classCodes, arities, numClasses):
+    '''
+    Builds the full attribute-value x class count table for a node in one pass over its rows.
+
+    The values of every attribute are laid out one after another along the first axis, so the counts for attribute i
+    are in rows offsets[i]:offsets[i+1] where offsets = [0] + cumsum(arities).
+
+    Parameters:
+        attributeCodes - A 2D integer array with one row per data row and one column per attribute.
+            Codes outside of [0, arity) are not counted
+        classCodes - A 1D integer array with the class code of each data row.
+            Rows with codes outside of [0, numClasses) are counted towards their attribute value, but not towards any class
+        arities - The number of values of each attribute
+        numClasses - The number of classes
+    Returns:
+        A tuple (valueCounts, valueClassCounts).  valueCounts[j] is the number of rows that have the j-th attribute value,
+        and valueClassCounts[j, c] is the number of those rows that also have class c.
+    '''
+
+    arities = np.asarray(arities, dtype=np.int64)
+    totalValues = int(arities.sum())
+    numCells = totalValues * (numClasses + 1)
+    # Codes outside of the arities are only masked out after the index is computed, so the index has to fit them too.
+    largestCode = int(np.iinfo(attributeCodes.dtype).max) if np.issubdtype(attributeCodes.dtype, np.integer) else 0
+    indexType = indexDtype((totalValues + largestCode + 1) * (numClasses + 1))
+    offsets = np.concatenate(([0], np.cumsum(arities)[:-1])).astype(indexType)
+    indexArities = arities.astype(indexType)
+
+    # The rows are counted a chunk at a time, so the temporary index arrays stay small next to the codes.
+    counts = np.zeros(numCells, dtype=np.int64)
+    chunkRows = max(1, chunkCells // max(attributeCodes.shape[1], 1))
+    for start in range(0, len(attributeCodes), chunkRows):
+        chunkClasses = classCodes[start:start + chunkRows]
+        # The last class slot collects the rows whose class is not one of the counted classes.
+        classSlots = np.where((chunkClasses >= 0) & (chunkClasses < numClasses), chunkClasses, numClasses).astype(indexType)
+        codes = attributeCodes[start:start + chunkRows].astype(indexType)
+        counted = (codes >= 0) & (codes < indexArities)
+        cellIndex = (offsets + codes) * (numClasses + 1) + classSlots[:, np.newaxis]
+        counts += np.bincount(cellIndex[counted], minlength=numCells)
+    counts = counts.reshape(totalValues, numClasses + 1)
+
+    return counts.sum(axis=1), counts[:, :numClasses]
+
+def attributeScores(noisyValueCounts, noisyValueClassCounts, arities):
+    '''
+    Computes the V_a score of every attribute from its noisy count table.
+
+    V_a is the sum of N_vc * log2(N_vc / N_v) over the combinations where both noisy counts are positive.
+
+    Parameters:
+        noisyValueCounts - The per-value counts returned by countAttributeValueClasses, with noise added
+        noisyValueClassCounts - The per-value, per-class counts returned by countAttributeValueClasses, with noise added
+        arities - The number of values of each attribute
+    Returns:
+        A 1D array with the V_a score of each attribute
+    '''
+
+    # If the number of occurences is 0 or negative, a log could not be calculated with them,
+    # so those combinations contribute nothing.
+    usable = (noisyValueCounts[:, np.newaxis] > 0) & (noisyValueClassCounts > 0)
+    ratios = np.where(usable, noisyValueClassCounts / np.where(noisyValueCounts > 0, noisyValueCounts, 1)[:, np.newaxis], 1)
+    terms = np.where(usable, noisyValueClassCounts * np.log2(ratios), 0).sum(axis=1)
+
+    valueAttributes = np.repeat(np.arange(len(arities)), arities)
+    return np.bincount(valueAttributes, weights=terms, minlength=len(arities))
+
+def classCounts(classCodes, numClasses):
+    '''
+    Counts the rows of each class.
+
+    Parameters:
+        classCodes - A 1D integer array with the class code of each row.  Codes outside of [0, numClasses) are ignored
+        numClasses - The number of classes
+    Returns:
+        A 1D array with the count of each class
+    '''
+
+    counted = classCodes[(classCodes >= 0) & (classCodes < numClasses)]
+    return np.bincount(counted, minlength=numClasses)
+
+def entropyOfCounts(counts):
+    '''
+    Calculates the entropy of the class distribution in each row of an array of class counts.
+
+    Parameters:
+        counts - An array whose last axis holds the number of rows of each class
+    Returns:
+        An array with the entropy of each distribution.  Distributions without any rows have an entropy of 0
+    '''
+
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals != 0)
+    return -np.sum(p * np.log2(p, out=np.zeros(counts.shape), where=p > 0), axis=-1)
+
+def informationGains(valueClassCounts, classCounts, arities):
+    '''
+    Calculates the exact information gain of splitting on every attribute from one count table.
+
+    Parameters:
+        valueClassCounts - The per-value, per-class counts returned by countAttributeValueClasses
+        classCounts - The number of rows of each class in the node
+        arities - The number of values of each attribute
+    Returns:
+        A 1D array with the information gain of each attribute
+    '''
+
+    numRows = np.sum(classCounts)
+    valueTotals = valueClassCounts.sum(axis=1)
+    weightedEntropies = valueTotals / numRows * entropyOfCounts(valueClassCounts)
+    valueAttributes = np.repeat(np.arange(len(arities)), arities)
+    return entropyOfCounts(classCounts) - np.bincount(valueAttributes, weights=weightedEntropies, minlength=len(arities))
@@ -1,5 +1,11 @@
+import hashlib
+import json
+import os
 import re
+import shutil
+import tempfile
 
+import numpy as np
 import pandas as pd
 
 def readMushroomColumnDefinitions(namesFilePath):
@@ -55,6 +61,121 @@ def readNurseryColumnDefinitions(namesFilePath):
     return attributeMap
 
 
+def encodeColumn(column, values):
+    """
+    Converts a column of categorical strings into compact integer codes
+
+    Parameters:
+        column - a pandas Series containing the values to encode
+        values - the list of known values for the column.  The i-th value is given the code i.
+    Returns:
+        A tuple (codes, labels) where codes is an unsigned integer array and labels is the list of strings for each code.
+        Values in the column that are not in the values list are given codes after the known values so that no row is lost.
+    """
+
+    labels = list(values)
+    codeForLabel = {}
+    for code, label in enumerate(labels):
+        codeForLabel.setdefault(label, code)
+    for label in pd.unique(column):
+        if label not in codeForLabel:
+            codeForLabel[label] = len(labels)
+            labels.append(label)
+
+    dtype = np.uint8 if len(labels) <= 256 else np.uint16
+    codes = column.map(codeForLabel).to_numpy(dtype=dtype)
+    return codes, labels
+
+
+def boundedBinEdges(low, high, numBins):
+    """
+    Computes the edges of numBins histogram bins of equal width between public bounds
+
+    Parameters:
+        low, high - the bounds of the values, chosen without looking at the data
+        numBins - the number of bins
+    Returns:
+        The list of the edges between bins, without the outer edges.  Values outside the bounds go in the outer bins
+    """
+
+    if not low < high:
+        raise ValueError(f"The lower bound {low} must be smaller than the upper bound {high}")
+    return [ float(edge) for edge in np.linspace(low, high, numBins + 1)[1:-1] ]
+
+def numericBinEdges(values, numBins, binning):
+    """
+    Computes the edges of the histogram bins of a numeric column from its values.
+    The edges reveal values of the column (its smallest and largest value, or its quantiles), and this is not
+    covered by any privacy budget, so only use them when the data is public.  See boundedBinEdges otherwise
+
+    Parameters:
+        values - a float array.  NaN values are ignored
+        numBins - the largest number of bins
+        binning - "width" for bins of equal width between the smallest and largest value,
+            or "quantile" for bins that hold about the same number of values
+    Returns:
+        The sorted list of the edges between bins, without the outer edges.  Quantile bins that would be empty
+        because of repeated values are merged, so there can be fewer than numBins - 1 edges.
+    """
+
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return []
+    if binning == "width":
+        edges = np.linspace(values.min(), values.max(), numBins + 1)
+    elif binning == "quantile":
+        edges = np.quantile(values, np.linspace(0, 1, numBins + 1))
+    else:
+        raise ValueError(f"Unknown binning {binning!r}, expected 'width' or 'quantile'")
+    return [ float(edge) for edge in np.unique(edges[1:-1]) ]
+
+def binNumericColumn(column, edges):
+    """
+    Converts a column of numbers into the integer codes of the histogram bins they fall in
+
+    Parameters:
+        column - a pandas Series containing numbers, or strings of numbers.  Anything else counts as missing
+        edges - the edges between bins, as returned by numericBinEdges.  A value equal to an edge goes in the upper bin
+    Returns:
+        A tuple (codes, labels) like encodeColumn, where labels names the range of each bin, such as "[2.5, 4)".
+        Missing values get the code after the bins, labelled "?".
+    """
+
+    values = pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+    codes = np.searchsorted(edges, values, side="right")
+    bounds = ["-inf"] + [ f"{edge:g}" for edge in edges ] + ["inf"]
+    labels = [ f"[{low}, {high})" for low, high in zip(bounds[:-1], bounds[1:]) ]
+    missing = np.isnan(values)
+    if missing.any():
+        codes[missing] = len(labels)
+        labels.append("?")
+
+    dtype = np.uint8 if len(labels) <= 256 else np.uint16
+    return codes.astype(dtype), labels
+
+def binNumericValues(column, edges, binLabels):
+    """
+    Puts the values of new rows of a numeric attribute in the bins of an existing encoding
+
+    Parameters:
+        column - a pandas Series of numbers, strings of numbers, missing values, or labels of the bins
+        edges - the edges between the bins of the encoding
+        binLabels - the value labels of the attribute in the encoding.  Values that already are one of them are kept
+    Returns:
+        A pandas Series with the label of the bin of every value, and "?" for missing values
+    """
+
+    isLabel = column.isin(binLabels).to_numpy()
+    isMissing = column.isna().to_numpy()
+    numbers = pd.to_numeric(column.where(~isLabel), errors="coerce")
+    notNumbers = numbers.isna().to_numpy() & ~isLabel & ~isMissing
+    if notNumbers.any():
+        raise ValueError(f"The numeric attribute {column.name!r} has the value {column.iloc[np.flatnonzero(notNumbers)[0]]!r}, which is not a number")
+    codes, labels = binNumericColumn(numbers, edges)
+    binned = np.array(labels + ["?"], dtype=object)[codes]
+    return pd.Series(np.where(isLabel, column.to_numpy(dtype=object), binned), index=column.index, name=column.name)
+
+
 class DatasetConfiguration:
     def __init__(self):
         self.dataframe = pd.DataFrame()
@@ -62,16 +183,249 @@ class DatasetConfiguration:
         self.classColumn = ""
         self.classes = []
 
+        # Numeric attributes, binned by encode().  numericAttributes maps each of them to its number of bins.
+        # Their values in attributeMap are replaced by the bin labels.
+        # binEdges holds the edges of every binned attribute.  Edges that are already there are used as they are, so that
+        # edges can be chosen in advance and another dataframe can be binned like this one.  The edges of the other
+        # attributes come from their (low, high) bounds in binBounds (see boundedBinEdges), or, only when binning is
+        # "width" or "quantile", from the data itself (see numericBinEdges).
+        self.numericAttributes = {}
+        self.binning = None
+        self.binEdges = {}
+        self.binBounds = {}
+
+        # Integer-coded copy of the dataframe, filled in by encode().
+        # matrix has one column per attribute (in the order of attributes) and one row per row of the dataframe.
+        # The codes of an attribute index into valueLabels[attribute], and the codes of classCodes index into classLabels.
+        # The values listed in attributeMap and classes always come first, so their codes match their list position.
+        self.attributes = []
+        self.valueLabels = {}
+        self.classLabels = []
+        self.matrix = np.empty((0, 0), dtype=np.uint8)
+        self.classCodes = np.empty(0, dtype=np.uint8)
+        # The columns of the dataframe in their original order, used to rebuild it with decode().
+        self.dataframeColumns = []
+
+    @property
+    def dataframe(self):
+        # Configurations read from the cache have no dataframe until something asks for it.
+        if self._dataframe is None:
+            self._dataframe = self.decode()
+        return self._dataframe
+
+    @dataframe.setter
+    def dataframe(self, dataframe):
+        self._dataframe = dataframe
+
+    def encode(self):
+        """
+        Builds the integer-coded matrix and class codes from the dataframe, attributeMap and classes.
+        """
+        self.attributes = list(self.attributeMap.keys())
+        self.dataframeColumns = list(self.dataframe.columns)
+        self.attributeMap = dict(self.attributeMap)
+        self.valueLabels = {}
+        columns = []
+        for attributeName in self.attributes:
+            if attributeName in self.numericAttributes:
+                if attributeName in self.binEdges:
+                    if np.any(np.diff(self.binEdges[attributeName]) <= 0):
+                        raise ValueError(f"The bin edges of {attributeName} must be increasing: {self.binEdges[attributeName]}")
+                elif attributeName in self.binBounds:
+                    self.binEdges[attributeName] = boundedBinEdges(*self.binBounds[attributeName], self.numericAttributes[attributeName])
+                elif self.binning is not None:
+                    values = pd.to_numeric(self.dataframe[attributeName], errors="coerce").to_numpy(dtype=np.float64)
+                    self.binEdges[attributeName] = numericBinEdges(values, self.numericAttributes[attributeName], self.binning)
+                else:
+                    raise ValueError(f"The numeric attribute {attributeName} has no binEdges or binBounds.  Set binning to "
+                                     "'width' or 'quantile' to compute its edges from the data, which reveals values of it")
+                codes, labels = binNumericColumn(self.dataframe[attributeName], self.binEdges[attributeName])
+                # Missing values are not a listed value, like the values of categorical attributes that are not in attributeMap.
+                self.attributeMap[attributeName] = [ label for label in labels if label != "?" ]
+            else:
+                codes, labels = encodeColumn(self.dataframe[attributeName], self.attributeMap[attributeName])
+            self.valueLabels[attributeName] = labels
+            columns.append(codes)
+        dtype = np.result_type(np.uint8, *columns)
+        self.matrix = np.empty((len(self.dataframe), len(self.attributes)), dtype=dtype)
+        for column, codes in enumerate(columns):
+            self.matrix[:, column] = codes
+        self.classCodes, self.classLabels = encodeColumn(self.dataframe[self.classColumn], self.classes)
+
+    def decode(self):
+        """
+        Rebuilds a string dataframe from the integer-coded matrix and class codes.
+        Numeric attributes hold the labels of their bins instead of their original values.
+        """
+        columns = {}
+        for columnName in self.dataframeColumns:
+            if columnName == self.classColumn:
+                codes, labels = self.classCodes, self.classLabels
+            else:
+                codes, labels = self.matrix[:, self.attributes.index(columnName)], self.valueLabels[columnName]
+            columns[columnName] = np.array(labels, dtype=object)[codes]
+        return pd.DataFrame(columns, columns=self.dataframeColumns)
+
+def encodeDataframe(dataframe, attributeMap, classColumn, classes, numericAttributes=None, binning=None, binEdges=None, binBounds=None) -> DatasetConfiguration:
+    """
+    Wraps an arbitrary dataframe in an encoded DatasetConfiguration object.
+    numericAttributes optionally maps attributes of attributeMap that hold numbers to their number of bins.
+    Their bins come from binEdges, a dictionary from attributes to the edges between their bins, or binBounds,
+    a dictionary from attributes to the (low, high) bounds of their values.  Attributes in binEdges count as numeric
+    even if they are not in numericAttributes.  binning only computes the edges of the other numeric attributes
+    from the data when it is "width" or "quantile", since those edges are not private (see numericBinEdges).
+    """
+    config = DatasetConfiguration()
+    config.dataframe = dataframe
+    config.attributeMap = attributeMap
+    config.classColumn = classColumn
+    config.classes = classes
+    config.numericAttributes = dict(numericAttributes or {})
+    config.binning = binning
+    config.binEdges = { attribute: [ float(edge) for edge in edges ] for attribute, edges in (binEdges or {}).items() }
+    for attribute, edges in config.binEdges.items():
+        config.numericAttributes.setdefault(attribute, len(edges) + 1)
+    config.binBounds = { attribute: (float(low), float(high)) for attribute, (low, high) in (binBounds or {}).items() }
+    config.encode()
+
+    return config
+
+# == dataset cache ==
+# The loaders in choices parse their source files once and keep the encoded result in
+# cacheDirectory/<dataset>-<hash>/, where the hash covers the contents of every source file.
+# matrix.npy and classCodes.npy hold the codes and metadata.json holds everything else, so reopening the cache
+# needs no parsing and the arrays are memory-mapped instead of read.
+# Set cacheDirectory to None to always parse the source files.  Bump cacheFormatVersion whenever a loader
+# or encode() changes what it produces, so that old caches are not used.
+
+cacheDirectory = 'data/cache'
+cacheFormatVersion = 3
+
+def hashFiles(paths):
+    """
+    Hashes the contents of several files, along with cacheFormatVersion.
+
+    Parameters:
+        paths - a list of file paths
+    Returns:
+        A hex string that changes whenever any of the files or the cache format changes
+    """
+
+    digest = hashlib.sha256(f"datasets cache version {cacheFormatVersion}".encode())
+    for path in paths:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+def datasetMetadata(config):
+    """
+    Returns everything about an encoded DatasetConfiguration except its arrays and dataframe, as a dictionary
+    from attribute names to JSON-compatible values.  Setting these attributes on a new DatasetConfiguration,
+    along with matrix and classCodes, restores it.
+    """
+    return {
+        "attributeMap": config.attributeMap,
+        "classColumn": config.classColumn,
+        "classes": config.classes,
+        "attributes": config.attributes,
+        "valueLabels": config.valueLabels,
+        "classLabels": config.classLabels,
+        "dataframeColumns": config.dataframeColumns,
+        "numericAttributes": config.numericAttributes,
+        "binning": config.binning,
+        "binEdges": config.binEdges,
+        "binBounds": config.binBounds,
+    }
+
+def writeDatasetCache(config, directory):
+    """
+    Writes an encoded DatasetConfiguration to a cache directory.
+    The directory is built under a temporary name and renamed into place, so readers never see a partial cache.
+
+    Parameters:
+        config - a DatasetConfiguration object whose encode() method has been called
+        directory - the cache directory to create
+    """
+
+    metadata = datasetMetadata(config)
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    temporaryDirectory = tempfile.mkdtemp(dir=parent)
+    try:
+        np.save(os.path.join(temporaryDirectory, 'matrix.npy'), config.matrix)
+        np.save(os.path.join(temporaryDirectory, 'classCodes.npy'), config.classCodes)
+        with open(os.path.join(temporaryDirectory, 'metadata.json'), 'w') as file:
+            json.dump(metadata, file)
+        os.rename(temporaryDirectory, directory)
+    except OSError:
+        # Another process may have written the same cache first, in which case its copy is used.
+        shutil.rmtree(temporaryDirectory, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+
+def readDatasetCache(directory) -> DatasetConfiguration:
+    """
+    Opens a cache directory written by writeDatasetCache.
+
+    Parameters:
+        directory - the cache directory
+    Returns:
+        An encoded DatasetConfiguration object with memory-mapped, read-only matrix and classCodes.
+        Its dataframe is only decoded from the codes when it is first used.
+    """
+
+    with open(os.path.join(directory, 'metadata.json')) as file:
+        metadata = json.load(file)
+    config = DatasetConfiguration()
+    config.dataframe = None
+    for name, value in metadata.items():
+        setattr(config, name, value)
+    config.matrix = np.load(os.path.join(directory, 'matrix.npy'), mmap_mode='r')
+    config.classCodes = np.load(os.path.join(directory, 'classCodes.npy'), mmap_mode='r')
+    return config
+
+def loadCachedDataset(name, sourcePaths, parse) -> DatasetConfiguration:
+    """
+    Loads a dataset from the cache, parsing and caching it first if its source files have no cache yet.
+
+    Parameters:
+        name - the name of the dataset, used in the name of the cache directory
+        sourcePaths - every file parse reads
+        parse - a function with no parameters that parses the source files and returns an encoded DatasetConfiguration
+    Returns:
+        An encoded DatasetConfiguration object
+    """
+
+    if cacheDirectory is None:
+        return parse()
+    directory = os.path.join(cacheDirectory, f"{name}-{hashFiles(sourcePaths)}")
+    if not os.path.isdir(directory):
+        config = parse()
+        try:
+            writeDatasetCache(config, directory)
+        except OSError:
+            # A read-only data folder only costs the speedup.
+            return config
+    return readDatasetCache(directory)
+
 def loadMushroomDataset() -> DatasetConfiguration:
     """
     Loads the mushroom dataset and returns a DatasetConfiguration object.
     """
+    return loadCachedDataset('mushroom', ['data/Mushrooms/agaricus-lepiota.names', 'data/Mushrooms/agaricus-lepiota.data'], parseMushroomDataset)
+
+def parseMushroomDataset() -> DatasetConfiguration:
+    """
+    Parses the mushroom dataset from its source files and returns a DatasetConfiguration object.
+    """
     config = DatasetConfiguration()
     config.attributeMap = readMushroomColumnDefinitions('data/Mushrooms/agaricus-lepiota.names')
     columnNames = ["Class"] + list(config.attributeMap.keys())
     config.dataframe = pd.read_csv('data/Mushrooms/agaricus-lepiota.data', dtype=str, names=columnNames)
     config.classColumn = "Class"
     config.classes = ["p", "e"]
+    config.encode()
 
     return config
 
@@ -79,6 +433,12 @@ def loadBreastCancerDataset() -> DatasetConfiguration:
     """
     Loads the breast cancer dataset and returns a DatasetConfiguration object.
     """
+    return loadCachedDataset('breastCancer', ['data/Breast Cancer/breast-cancer.data'], parseBreastCancerDataset)
+
+def parseBreastCancerDataset() -> DatasetConfiguration:
+    """
+    Parses the breast cancer dataset from its source file and returns a DatasetConfiguration object.
+    """
     config = DatasetConfiguration()
     config.attributeMap = {
         "age": ["10-19", "20-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80-89", "90-99"],
@@ -97,6 +457,7 @@ def loadBreastCancerDataset() -> DatasetConfiguration:
     config.dataframe = pd.read_csv('data/Breast Cancer/breast-cancer.data', dtype=str, names=columnNames)
     config.classColumn = "Class"
     config.classes = ["no-recurrence-events", "recurrence-events"]
+    config.encode()
 
     return config
 
@@ -104,18 +465,103 @@ def loadNurseryDataset() -> DatasetConfiguration:
     """
     Loads the nursery dataset and returns a DatasetConfiguration object.
     """
+    return loadCachedDataset('nursery', ['data/Nursery/nursery.names', 'data/Nursery/nursery.data'], parseNurseryDataset)
+
+def parseNurseryDataset() -> DatasetConfiguration:
+    """
+    Parses the nursery dataset from its source files and returns a DatasetConfiguration object.
+    """
     config = DatasetConfiguration()
     config.attributeMap = readNurseryColumnDefinitions('data/Nursery/nursery.names')
     columnNames = columnNames = list(config.attributeMap.keys()) + ["Class"]
     config.dataframe = pd.read_csv('data/Nursery/nursery.data', dtype=str, names=columnNames)
     config.classColumn = "Class"
     config.classes = ["not_recom","recommend","very_recom","priority","spec_prior"]
+    config.encode()
 
 
     return  config
 
+def loadCSVDataset(path, classColumn, classes=None, attributeMap=None, numericAttributes=None, binning=None, columnNames=None, binEdges=None, binBounds=None) -> DatasetConfiguration:
+    """
+    Loads any CSV file whose rows are examples and returns a DatasetConfiguration object.
+
+    Parameters:
+        path - the CSV file
+        classColumn - the column that holds the class
+        classes - the list of possible classes.  By default the classes found in the file are used
+        attributeMap - the attributes to use and their possible values.  By default every column except classColumn is used,
+            with the values found in the file
+        numericAttributes - optionally, a dictionary from the attributes that hold numbers to their number of bins.
+            They are binned once, when the file is first parsed, so the trees split on the bins
+        binning - None, or "quantile" or "width" to compute the bin edges of the numeric attributes that have none from the
+            file itself.  Such edges are saved with every model and reveal values of the file, see numericBinEdges
+        columnNames - the names of the columns, if the first line of the file does not name them
+        binEdges - optionally, a dictionary from numeric attributes to the edges between their bins
+        binBounds - optionally, a dictionary from numeric attributes to the public (low, high) bounds of their values,
+            which are split into bins of equal width
+    """
+
+    def parse():
+        dataframe = pd.read_csv(path, dtype=str, names=columnNames, header=None if columnNames is not None else 'infer')
+        attributes = attributeMap
+        if attributes is None:
+            attributes = { column: sorted(dataframe[column].dropna().unique()) for column in dataframe.columns if column != classColumn }
+        fileClasses = classes if classes is not None else sorted(dataframe[classColumn].dropna().unique())
+        return encodeDataframe(dataframe, attributes, classColumn, list(fileClasses), numericAttributes, binning, binEdges, binBounds)
+
+    # The cache of a file depends on how it is read and binned, not only on its contents.
+    options = json.dumps([classColumn, classes, attributeMap, numericAttributes, binning, columnNames, binEdges, binBounds], sort_keys=True)
+    name = f"{os.path.splitext(os.path.basename(path))[0]}-{hashlib.sha256(options.encode()).hexdigest()[:8]}"
+    return loadCachedDataset(name, [path], parse)
+
+def makeSyntheticDataset(numRows=10000, numAttributes=10, arity=4, numClasses=2, labelNoise=0.1, seed=0) -> DatasetConfiguration:
+    """
+    Generates a random categorical dataset, already encoded, for benchmarking.
+
+    Parameters:
+        numRows - the number of rows
+        numAttributes - the number of attributes, named a0, a1, ...
+        arity - the number of values of every attribute, named v0, v1, ...
+        numClasses - the number of classes, named c0, c1, ...
+        labelNoise - the proportion of rows whose class is replaced with a random one
+        seed - the seed of the random draws, so the same parameters always give the same dataset
+    Returns:
+        A DatasetConfiguration object.  Its dataframe is only decoded from the codes when it is first used.
+    """
+
+    rng = np.random.default_rng(seed)
+    dtype = np.uint8 if arity <= 256 else np.uint16
+    config = DatasetConfiguration()
+    config.dataframe = None
+    config.attributes = [ f"a{i}" for i in range(numAttributes) ]
+    config.classColumn = "class"
+    config.dataframeColumns = config.attributes + [config.classColumn]
+    config.valueLabels = { attribute: [ f"v{i}" for i in range(arity) ] for attribute in config.attributes }
+    config.attributeMap = { attribute: list(labels) for attribute, labels in config.valueLabels.items() }
+    config.classes = [ f"c{i}" for i in range(numClasses) ]
+    config.classLabels = list(config.classes)
+    config.matrix = rng.integers(arity, size=(numRows, numAttributes), dtype=dtype)
+
+    # The class depends on the first few attributes only, so a shallow tree can learn it.
+    informative = config.matrix[:, :min(numAttributes, 3)].astype(np.int64)
+    weights = rng.integers(1, max(arity, 2), size=informative.shape[1])
+    classCodes = (informative @ weights) % numClasses
+    noisy = rng.random(numRows) < labelNoise
+    classCodes[noisy] = rng.integers(numClasses, size=int(noisy.sum()))
+    config.classCodes = classCodes.astype(np.uint8 if numClasses <= 256 else np.uint16)
+
+    return config
+
+def loadSyntheticDataset() -> DatasetConfiguration:
+    """
+    Generates the default synthetic dataset and returns a DatasetConfiguration object.
+    """
+    return makeSyntheticDataset()
+
 choices = {
     'mushroom': loadMushroomDataset,
     'breastCancer': loadBreastCancerDataset,
-    'nursery': loadNurseryDataset
+    'nursery': loadNurseryDataset,
+    'synthetic': loadSyntheticDataset
 }
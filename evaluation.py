@@ -1,5 +1,112 @@
+import numpy as np
 import pandas as pd
 
+import treenode
+
+def predictDecisionTree(decisionTree, datasetConfig, rows=None):
+    '''
+    Classify the rows of an encoded dataset with a single pass of predictions.
+
+    Parameters:
+        decisionTree - A TreeNode, a CompiledTree, or any object with an evaluate(row) method such as a RandomGuesser
+        datasetConfig - An encoded DatasetConfiguration containing the rows to classify
+        rows - Optionally, an array with the indices of the rows to classify.  All rows are classified by default
+    Returns:
+        A 1D array with the predicted class code of each row.  The codes index into datasetConfig.classLabels
+    '''
+
+    if isinstance(decisionTree, treenode.TreeNode):
+        decisionTree = treenode.compileTree(decisionTree, datasetConfig)
+    if hasattr(decisionTree, "predict_batch"):
+        matrix = datasetConfig.matrix if rows is None else datasetConfig.matrix[rows]
+        return decisionTree.predict_batch(matrix)
+
+    # Other models can only classify pandas rows, so they fall back to classifying one row at a time.
+    dataframe = datasetConfig.dataframe if rows is None else datasetConfig.dataframe.iloc[rows]
+    codeForClass = { label: code for code, label in enumerate(datasetConfig.classLabels) }
+    return np.array([ codeForClass[decisionTree.evaluate(row)] for index, row in dataframe.iterrows() ], dtype=np.int32)
+
+def confusionMatrix(trueClasses, predictedClasses, numClasses):
+    '''
+    Count how often each true class was predicted as each class.
+
+    Parameters:
+        trueClasses - A 1D array of true class codes
+        predictedClasses - A 1D array of predicted class codes, in the same order as trueClasses
+        numClasses - The number of possible class codes
+    Returns:
+        A numClasses x numClasses array where entry [t, p] is the number of rows with true class t that were predicted as p
+    '''
+
+    cellIndex = np.asarray(trueClasses, dtype=np.int64) * numClasses + np.asarray(predictedClasses, dtype=np.int64)
+    return np.bincount(cellIndex, minlength=numClasses * numClasses).reshape(numClasses, numClasses)
+
+def metricsFromConfusionMatrix(confusion):
+    '''
+    Derive the evaluation metrics from a confusion matrix.
+
+    Only the classes that actually occur in the true data take part in the F1 averages.
+
+    Parameters:
+        confusion - A confusion matrix as returned by confusionMatrix
+    Returns:
+        A dictionary with the keys
+            accuracy - the proportion of rows that are correctly classified
+            macroF1Score - the unweighted mean of the per-class F1 scores
+            weightedF1Score - the mean of the per-class F1 scores weighted by the number of rows of each class
+            precision, recall, f1Score - arrays with the value for each class code
+    '''
+
+    correct = np.diag(confusion).astype(float)
+    trueCounts = confusion.sum(axis=1)
+    predictedCounts = confusion.sum(axis=0)
+    total = trueCounts.sum()
+
+    precision = np.divide(correct, predictedCounts, out=np.zeros_like(correct), where=predictedCounts != 0)
+    recall = np.divide(correct, trueCounts, out=np.zeros_like(correct), where=trueCounts != 0)
+    precisionPlusRecall = precision + recall
+    f1Score = np.divide(2 * precision * recall, precisionPlusRecall, out=np.zeros_like(correct), where=precisionPlusRecall != 0)
+
+    presentClasses = trueCounts > 0
+    return {
+        "accuracy": correct.sum() / total,
+        "macroF1Score": f1Score[presentClasses].mean(),
+        "weightedF1Score": (trueCounts * f1Score).sum() / total,
+        "precision": precision,
+        "recall": recall,
+        "f1Score": f1Score,
+    }
+
+def evaluateDecisionTree(decisionTree, datasetConfig, rows=None, predictions=None):
+    '''
+    Calculate every evaluation metric of a decision tree from a single pass of predictions.
+
+    Parameters:
+        decisionTree - The model to evaluate (see predictDecisionTree).  It is not used if predictions are given
+        datasetConfig - An encoded DatasetConfiguration containing the rows to classify
+        rows - Optionally, an array with the indices of the rows to evaluate on.  All rows are used by default
+        predictions - Optionally, an array of precomputed predicted class codes for those rows
+    Returns:
+        The dictionary of metrics returned by metricsFromConfusionMatrix
+    '''
+
+    if predictions is None:
+        predictions = predictDecisionTree(decisionTree, datasetConfig, rows)
+    trueClasses = datasetConfig.classCodes if rows is None else datasetConfig.classCodes[rows]
+    confusion = confusionMatrix(trueClasses, predictions, len(datasetConfig.classLabels))
+    return metricsFromConfusionMatrix(confusion)
+
+def _metricsOfDataframe(decisionTree, dataframe, classColumn):
+    # Classifies every row of the dataframe once and summarizes the result with a confusion matrix.
+    trueLabels = dataframe[classColumn].to_numpy()
+    predictedLabels = np.array([ decisionTree.evaluate(row) for index, row in dataframe.iterrows() ], dtype=object)
+    labels = list(pd.unique(trueLabels))
+    labels += [ label for label in pd.unique(predictedLabels) if label not in labels ]
+    codeForLabel = { label: code for code, label in enumerate(labels) }
+    trueClasses = [ codeForLabel[label] for label in trueLabels ]
+    predictedClasses = [ codeForLabel[label] for label in predictedLabels ]
+    return metricsFromConfusionMatrix(confusionMatrix(trueClasses, predictedClasses, len(labels)))
+
 def calculateAccuracyOfDecisionTree(decisionTree, dataframe, classColumn):
     '''
     Calculate the accuracy of a decision tree at classifying rows in a dataset.
@@ -13,12 +120,7 @@ def calculateAccuracyOfDecisionTree(decisionTree, dataframe, classColumn):
         A number between 0 and 1 representing the proportion of rows that are correctly classified by the decision tree
     '''
 
-    countCorrect = 0
-    for index, row in dataframe.iterrows():
-        decisionTreeResult = decisionTree.evaluate(row)
-        if decisionTreeResult == row[classColumn]:
-            countCorrect += 1
-    return countCorrect / len(dataframe)
+    return _metricsOfDataframe(decisionTree, dataframe, classColumn)["accuracy"]
 
 def calculateFScoreOfDecisionTree(decisionTree, dataframe, classColumn):
     '''
@@ -30,37 +132,8 @@ def calculateFScoreOfDecisionTree(decisionTree, dataframe, classColumn):
         dataframe - A dataframe of many rows that contains data in the format the decision tree expects
         classColumn - The column that contains the class value
     Returns:
-
-
+        A tuple (macroFScore, weightedFScore)
     '''
-    classes = pd.unique(dataframe[classColumn])
-    trueClassCountDict = dataframe[classColumn].value_counts().to_dict()
-    predictedClassCountDict = dict.fromkeys(classes, 0)
-    correctPredictedClassDict = dict.fromkeys(classes, 0)
-    for index, row in dataframe.iterrows():
-        decisionTreeResult = decisionTree.evaluate(row)
-        predictedClassCountDict[decisionTreeResult] += 1
-        if decisionTreeResult == row[classColumn]:
-            correctPredictedClassDict[decisionTreeResult] += 1
-
-    fScoreDict = dict.fromkeys(classes,0)
-    for c in classes:
-        if predictedClassCountDict[c] != 0:
-            precison = correctPredictedClassDict[c]/predictedClassCountDict[c]
-        else:
-            precison = 0
-        recall = correctPredictedClassDict[c]/trueClassCountDict[c]
-        if precison == 0 or recall == 0:
-            fscore = 0
-        else:
-            fscore = 2 * (precison * recall)/ (precison + recall)
-        fScoreDict[c] = fscore
-
-
-    macroFScore = (sum(fScoreDict.values()))/len(fScoreDict)
-    weightedFScore = 0
-    for c in classes:
-        weightedFScore += trueClassCountDict[c] * fScoreDict[c]
-    weightedFScore = weightedFScore/len(dataframe)
-
-    return macroFScore, weightedFScore
+
+    metrics = _metricsOfDataframe(decisionTree, dataframe, classColumn)
+    return metrics["macroF1Score"], metrics["weightedF1Score"]
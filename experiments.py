@@ -0,0 +1,350 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+
+import numpy as np
+
+import countcache
+import datasets
+import evaluation
+import forest
+import id3
+import instrumentation
+import levelwise
+import models
+import noise
+import parallel
+import shareddataset
+import treenode
+
+columnNames = ["maxDepth", "epsilon", "mValue", "aProportion", "layerFunction", "accuracy", "macroF1Score", "weightedF1Score", "algorithm"]
+# The extra columns of commandLineArgs.compact: the size of each tree before and after treenode.compactTree.
+compactColumnNames = ["nodesBefore", "depthBefore", "nodesAfter", "depthAfter"]
+
+# == algorithms ==
+# The training algorithms that can be compared, all taking the following parameters:
+#     datasetConfig - the encoded DatasetConfiguration to train on
+#     paramConfig - the ID3Configuration of this iteration
+#     commandLineArgs - the arguments of the job, for algorithm specific options
+#     rows - the indices of the rows to train on, or None for all rows
+
+def _trainParallel(datasetConfig, paramConfig, commandLineArgs, algorithm, rows):
+    # Returns the tree of algorithm built by parallel.trainParallel, or None if the job did not ask for tree workers.
+    treeWorkers = getattr(commandLineArgs, "treeWorkers", 1)
+    if treeWorkers <= 1:
+        return None
+    processes = getattr(commandLineArgs, "treeExecutor", "thread") == "process"
+    return parallel.trainParallel(datasetConfig, paramConfig, algorithm, treeWorkers, processes, rows=rows)
+
+def _trainBetterDPID3(datasetConfig, paramConfig, commandLineArgs, rows=None):
+    tree = _trainParallel(datasetConfig, paramConfig, commandLineArgs, "better_DP_ID3", rows)
+    return tree if tree is not None else id3.trainBetterDPID3(datasetConfig, paramConfig, rows=rows)
+
+def _trainBetterDPID3LevelWise(datasetConfig, paramConfig, commandLineArgs, rows=None):
+    return levelwise.trainBetterDPID3LevelWise(datasetConfig, paramConfig, rows=rows)
+
+def _trainDPForest(datasetConfig, paramConfig, commandLineArgs, rows=None):
+    numTrees = getattr(commandLineArgs, "numTrees", 10)
+    vote = getattr(commandLineArgs, "vote", "majority")
+    forestWorkers = getattr(commandLineArgs, "forestWorkers", 1)
+    return forest.trainDPForest(datasetConfig, paramConfig, numTrees, vote, forestWorkers, rows=rows)
+
+def _trainDPID3(datasetConfig, paramConfig, commandLineArgs, rows=None):
+    tree = _trainParallel(datasetConfig, paramConfig, commandLineArgs, "DP_ID3", rows)
+    if tree is not None:
+        return tree
+    return id3.trainDPID3(datasetConfig, paramConfig.maxDepth, paramConfig.epsilon, noiseSource=paramConfig.noiseSource, rows=rows)
+
+def _trainID3(datasetConfig, paramConfig, commandLineArgs, rows=None):
+    # The non-private baseline uses neither the privacy budget nor maxDepth.
+    tree = _trainParallel(datasetConfig, None, commandLineArgs, "ID3", rows)
+    return tree if tree is not None else id3.trainID3(datasetConfig, rows=rows)
+
+algorithms = {
+    "better_DP_ID3": _trainBetterDPID3,
+    "better_DP_ID3_levelwise": _trainBetterDPID3LevelWise,
+    "DP_forest": _trainDPForest,
+    "DP_ID3": _trainDPID3,
+    "ID3": _trainID3
+}
+
+# The datasets used by runIteration, loaded at most once per process.
+_datasetConfigs = {}
+
+def _getDataset(datasetName):
+    if datasetName not in _datasetConfigs:
+        _datasetConfigs[datasetName] = datasets.choices[datasetName]()
+    return _datasetConfigs[datasetName]
+
+def registerDataset(datasetName, datasetConfig):
+    '''
+    Makes an encoded dataset that is not one of datasets.choices available to IterationJob and runJobs under a name.
+    The folds and cached counts of an earlier dataset with the same name are forgotten.
+
+    Parameters:
+        datasetName - The name jobs refer to the dataset by
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+    '''
+    unregisterDataset(datasetName)
+    _datasetConfigs[datasetName] = datasetConfig
+
+def unregisterDataset(datasetName):
+    '''
+    Forgets a dataset added with registerDataset, along with its folds and cached counts.
+    '''
+    _datasetConfigs.pop(datasetName, None)
+    for key in [ key for key in _folds if key[0] == datasetName ]:
+        del _folds[key]
+    if _countCache is not None:
+        # The paths of the count cache are prefixed with a (datasetName, split, fold) scope.
+        _countCache.removeWhere(lambda path: path[0][0] == datasetName)
+
+def _initializeWorker(datasetHandles):
+    # Worker processes attach to the datasets the parent published, instead of loading their own copies.
+    for datasetName, handle in datasetHandles.items():
+        _datasetConfigs[datasetName] = handle.attach()
+
+def splitRows(numRows, splitSeed, numFolds=None, testProportion=None):
+    '''
+    Split the row indices of a dataset into held-out folds.
+
+    Parameters:
+        numRows - The number of rows in the dataset
+        splitSeed - The seed of the random order of the rows
+        numFolds - For k-fold cross-validation, the number of folds
+        testProportion - For a single train/test split, the proportion of the rows to test on
+    Returns:
+        A list with a (trainRows, testRows) tuple of index arrays for each fold
+    '''
+
+    order = np.random.default_rng(splitSeed).permutation(numRows)
+    if numFolds is not None:
+        testParts = np.array_split(order, numFolds)
+        return [ (np.concatenate(testParts[:fold] + testParts[fold+1:]), testRows) for fold, testRows in enumerate(testParts) ]
+    numTest = int(round(numRows * testProportion))
+    return [ (order[numTest:], order[:numTest]) ]
+
+# The count cache shared by every iteration that runs in this process, created by the first job that asks for one.
+_countCache = None
+
+def _getCountCache(maxEntries):
+    global _countCache
+    if _countCache is None:
+        _countCache = countcache.CountCache(maxEntries)
+    return _countCache
+
+# The folds used by runIteration, computed at most once per process for each dataset and split.
+_folds = {}
+
+def _getFolds(datasetName, split):
+    if (datasetName, split) not in _folds:
+        _folds[(datasetName, split)] = splitRows(len(_getDataset(datasetName).classCodes), *split)
+    return _folds[(datasetName, split)]
+
+class IterationJob:
+    '''
+    Everything needed to train and evaluate one decision tree.
+
+    datasetName - A key of datasets.choices
+    commandLineArgs - An object with the maxDepth, epsilon, mValue, aProportion and layerFunction arguments of ID3Configuration
+    seedSequence - The numpy SeedSequence that seeds every random draw made for this tree
+    key - An identifier for the job, used to recognize jobs that already ran
+    algorithm - A key of algorithms
+    modelPath - If not None, the file the trained model is saved to with models.saveModel
+    split - If not None, a tuple with the arguments of splitRows after numRows.  The tree is trained on every row
+        outside of the fold and evaluated on the rows of the fold
+    fold - The index of the fold to hold out when split is given
+    foldSeedSequence - If not None, the parameters are still drawn from seedSequence, but the noise and every other
+        random draw of the training come from this SeedSequence instead, so that the folds of one set of parameters
+        get independent noise
+    '''
+
+    def __init__(self, datasetName, commandLineArgs, seedSequence, key=None, algorithm="better_DP_ID3", modelPath=None, split=None, fold=0,
+                 foldSeedSequence=None):
+        self.datasetName = datasetName
+        self.commandLineArgs = commandLineArgs
+        self.seedSequence = seedSequence
+        self.key = key
+        self.algorithm = algorithm
+        self.modelPath = modelPath
+        self.split = split
+        self.fold = fold
+        self.foldSeedSequence = foldSeedSequence
+
+def runIteration(job):
+    '''
+    Train and evaluate a single decision tree.
+
+    Parameters:
+        job - An IterationJob object
+    Returns:
+        A list with one value for each of the columns in columnNames, followed by one for each of the columns in
+        instrumentation.TrainingStats.columnNames if job.commandLineArgs.stats is set, and then one for each of the columns
+        in compactColumnNames if job.commandLineArgs.compact is set
+    '''
+
+    datasetConfig = _getDataset(job.datasetName)
+    paramConfig = id3.ID3Configuration(job.commandLineArgs, np.random.default_rng(job.seedSequence))
+    if job.foldSeedSequence is not None:
+        paramConfig.rng = np.random.default_rng(job.foldSeedSequence)
+        paramConfig.noiseSource = noise.mechanisms[getattr(job.commandLineArgs, "noiseMechanism", "laplace")](paramConfig.rng)
+    countCacheSize = getattr(job.commandLineArgs, "countCache", None)
+    if countCacheSize is not None:
+        paramConfig.countCache = _getCountCache(countCacheSize).scoped((job.datasetName, job.split, job.fold))
+    recordStats = getattr(job.commandLineArgs, "stats", False)
+    if recordStats:
+        paramConfig.stats = instrumentation.TrainingStats()
+    trainRows, testRows = (None, None) if job.split is None else _getFolds(job.datasetName, job.split)[job.fold]
+    model = algorithms[job.algorithm](datasetConfig, paramConfig, job.commandLineArgs, rows=trainRows)
+    compact = getattr(job.commandLineArgs, "compact", False)
+    if compact:
+        # Only TreeNode models can be compacted.  The columns of the others are left empty.
+        shapes = [None] * len(compactColumnNames)
+        if isinstance(model, treenode.TreeNode):
+            shapes = list(treenode.treeShape(model))
+            model = treenode.compactTree(model)
+            shapes += treenode.treeShape(model)
+    if job.modelPath is not None:
+        if isinstance(model, treenode.TreeNode):
+            model = treenode.compileTree(model, datasetConfig)
+        models.saveModel(job.modelPath, model)
+    metrics = evaluation.evaluateDecisionTree(model, datasetConfig, rows=testRows)
+    csvRow = [paramConfig.maxDepth, paramConfig.epsilon, paramConfig.mValue, paramConfig.aProportion, paramConfig.layerFunction.__name__, metrics["accuracy"], metrics["macroF1Score"], metrics["weightedF1Score"], job.algorithm]
+    if recordStats:
+        csvRow += paramConfig.stats.summary()
+    if compact:
+        csvRow += shapes
+    return csvRow
+
+def runJobs(jobs, workers, ordered=True):
+    '''
+    Run a list of IterationJob objects, spread over a number of processes.
+
+    Parameters:
+        jobs - A list of IterationJob objects
+        workers - The number of processes to use.  With 1 worker the jobs run in this process.  Otherwise the datasets are
+            loaded here and shared with the workers through shared memory (see shareddataset)
+        ordered - If True, results are yielded in the order of jobs.  Otherwise they are yielded as soon as they finish
+    Returns:
+        A generator that yields a (job, csvRow) tuple for each job
+    '''
+
+    if workers <= 1:
+        for job in jobs:
+            yield job, runIteration(job)
+        return
+
+    datasetNames = sorted({ job.datasetName for job in jobs })
+    sharedDatasets = { datasetName: shareddataset.publishDataset(_getDataset(datasetName)) for datasetName in datasetNames }
+    try:
+        datasetHandles = { datasetName: sharedDataset.handle for datasetName, sharedDataset in sharedDatasets.items() }
+        with ProcessPoolExecutor(workers, initializer=_initializeWorker, initargs=(datasetHandles,)) as executor:
+            if ordered:
+                chunkSize = max(1, len(jobs) // (workers * 4))
+                yield from zip(jobs, executor.map(runIteration, jobs, chunksize=chunkSize))
+            else:
+                futures = { executor.submit(runIteration, job): job for job in jobs }
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+    finally:
+        for sharedDataset in sharedDatasets.values():
+            sharedDataset.close()
+
+def runIterations(commandLineArgs):
+    '''
+    Run all of the iterations requested on the command line of main.py, spread over commandLineArgs.workers processes.
+    If commandLineArgs.saveModels is set, the model of each algorithm in each iteration is saved in that directory
+    as <algorithm>-<iteration>.npz.
+
+    Every iteration gets its own random stream spawned from commandLineArgs.seed, so a given seed produces
+    the same rows no matter how many workers are used.  Every algorithm in commandLineArgs.algorithm is run
+    with the same stream in each iteration, so they are compared with the same randomly drawn parameters.
+
+    If commandLineArgs.folds or commandLineArgs.testProportion is set, the rows are split once into held-out folds
+    that every iteration reuses.  Each fold is a separate job, so the folds are trained and evaluated in parallel,
+    and each job only receives the indices of its rows.
+    With more than one fold, the folds of an iteration share its parameters, but each draws its noise from its own
+    stream spawned from the iteration's stream, so that the errors of the folds are independent.
+
+    Parameters:
+        commandLineArgs - The parsed command line arguments of main.py
+    Returns:
+        A generator that yields one CSV row for each algorithm of each iteration, in iteration order.
+        With folds or a test split, each CSV row ends with a fold column.  With more than one fold, every algorithm of
+        every iteration has a row for each fold followed by a row with the mean over the folds, whose fold is "mean"
+    '''
+
+    rootSeedSequence = np.random.SeedSequence(commandLineArgs.seed)
+    seedSequences = rootSeedSequence.spawn(commandLineArgs.numIterations)
+    split = None
+    numFolds = 1
+    if getattr(commandLineArgs, "folds", None) is not None:
+        split = (int(rootSeedSequence.generate_state(1)[0]), commandLineArgs.folds, None)
+        numFolds = commandLineArgs.folds
+    elif getattr(commandLineArgs, "testProportion", None) is not None:
+        split = (int(rootSeedSequence.generate_state(1)[0]), None, commandLineArgs.testProportion)
+
+    modelDirectory = getattr(commandLineArgs, "saveModels", None)
+    if modelDirectory is not None:
+        os.makedirs(modelDirectory, exist_ok=True)
+    jobs = []
+    for iteration, seedSequence in enumerate(seedSequences):
+        # Every fold gets its own noise, shared by the algorithms like the parameters are.
+        foldSeedSequences = seedSequence.spawn(numFolds) if numFolds > 1 else [None]
+        for algorithm in commandLineArgs.algorithm:
+            for fold in range(numFolds):
+                modelPath = None
+                if modelDirectory is not None:
+                    modelName = f"{algorithm}-{iteration}" if split is None else f"{algorithm}-{iteration}-fold{fold}"
+                    modelPath = os.path.join(modelDirectory, modelName + ".npz")
+                jobs.append(IterationJob(commandLineArgs.dataset, commandLineArgs, seedSequence, algorithm=algorithm, modelPath=modelPath, split=split, fold=fold,
+                                        foldSeedSequence=foldSeedSequences[fold]))
+
+    foldRows = []
+    for job, csvRow in runJobs(jobs, commandLineArgs.workers):
+        if split is None:
+            yield csvRow
+            continue
+        foldRows.append(csvRow + [job.fold])
+        yield foldRows[-1]
+        if len(foldRows) == numFolds:
+            if numFolds > 1:
+                yield meanOfFolds(foldRows)
+            foldRows = []
+
+def meanOfFolds(foldRows):
+    '''
+    Combine the CSV rows of the folds of one algorithm in one iteration.
+
+    Parameters:
+        foldRows - The CSV rows of every fold, each ending with its fold index
+    Returns:
+        A CSV row with the mean of every numeric column that differs between the folds, the other columns of the
+        first fold, and "mean" as its fold
+    '''
+    meanRow = []
+    for values in zip(*[ row[:-1] for row in foldRows ]):
+        # Columns that are the same in every fold, like the parameters, keep their value and type.
+        numeric = [ value for value in values if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) ]
+        if len(numeric) == len(values) and any(value != values[0] for value in values):
+            meanRow.append(float(np.mean(numeric)))
+        else:
+            meanRow.append(values[0])
+    return meanRow + ["mean"]
+
+scoreColumnNames = ["model", "accuracy", "macroF1Score", "weightedF1Score"]
+
+def scoreModels(modelPaths, datasetConfig):
+    '''
+    Evaluate saved models on a dataset without training anything.
+
+    Parameters:
+        modelPaths - A list of files written by models.saveModel
+        datasetConfig - The encoded DatasetConfiguration to evaluate on
+    Returns:
+        A generator that yields one list with a value for each of the columns in scoreColumnNames for each model
+    '''
+
+    for modelPath in modelPaths:
+        model = models.alignModel(models.loadModel(modelPath), datasetConfig)
+        metrics = evaluation.evaluateDecisionTree(model, datasetConfig)
+        yield [modelPath, metrics["accuracy"], metrics["macroF1Score"], metrics["weightedF1Score"]]
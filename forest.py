@@ -0,0 +1,114 @@
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import id3
+import instrumentation
+import shareddataset
+import treenode
+
+class DPForest:
+    '''
+    An ensemble of differentially private decision trees, each trained on its own disjoint part of the rows.
+
+    Because no row is used by more than one tree, parallel composition means the whole forest only spends
+    the budget of one tree.
+
+    trees - A list of CompiledTree objects
+    vote - How the trees are combined:
+        "majority" - every tree votes for the class it predicts
+        "noisyCounts" - the noisy class counts of the leaf each row reaches are added up over the trees
+    '''
+
+    votes = ["majority", "noisyCounts"]
+
+    def __init__(self, trees, vote="majority"):
+        if vote not in DPForest.votes:
+            raise ValueError(f"Unknown vote {vote!r}, expected one of {DPForest.votes}")
+        self.trees = trees
+        self.vote = vote
+
+    def classScores(self, matrix):
+        '''
+        Adds up the votes of every tree for every row.
+
+        Parameters:
+            matrix - A 2D integer array of value codes with the same columns as the matrix the trees were trained on
+        Returns:
+            An array of shape (rows, classes) with the total vote for each class
+        '''
+        numClasses = len(self.trees[0].classLabels)
+        scores = np.zeros((len(matrix), numClasses))
+        for tree in self.trees:
+            if self.vote == "majority":
+                scores[np.arange(len(matrix)), tree.predict_batch(matrix)] += 1
+            else:
+                scores += tree.nodeCounts[tree.leafIndices(matrix)]
+        return scores
+
+    def predict_batch(self, matrix):
+        '''
+        Classifies every row of an integer-coded matrix.
+
+        Parameters:
+            matrix - A 2D integer array of value codes with the same columns as the matrix the trees were trained on
+        Returns:
+            A 1D array with the predicted class code of each row
+        '''
+        return np.argmax(self.classScores(matrix), axis=1)
+
+# The dataset used by _trainTree.  Worker processes get a shareddataset.DatasetHandle when they start, and attach to it.
+_datasetConfig = None
+
+def _initializeWorker(datasetConfig):
+    global _datasetConfig
+    _datasetConfig = datasetConfig.attach() if isinstance(datasetConfig, shareddataset.DatasetHandle) else datasetConfig
+
+def _trainTree(job):
+    rows, config = job
+    tree = id3.trainBetterDPID3(_datasetConfig, config, rows=rows)
+    return treenode.compileTree(tree, _datasetConfig), config.stats
+
+def trainDPForest(datasetConfig, config, numTrees, vote="majority", workers=1, rows=None):
+    '''
+    Train a forest of better_DP_ID3 trees on disjoint random partitions of the rows.
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        config - An ID3Configuration object.  Every tree gets the whole config.epsilon, since the partitions are disjoint
+        numTrees - The number of trees (and partitions)
+        vote - How the trees are combined when predicting (see DPForest)
+        workers - The number of processes to train the trees in
+        rows - Optionally, the indices of the rows to train on.  All rows are used by default
+    Returns:
+        A DPForest object
+    '''
+
+    if rows is None:
+        rows = np.arange(len(datasetConfig.matrix))
+    # The partition does not depend on the data, so it does not use any of the privacy budget.
+    partitions = np.array_split(config.rng.permutation(rows), numTrees)
+
+    jobs = []
+    for partition, noiseSource in zip(partitions, config.noiseSource.spawn(numTrees)):
+        treeConfig = copy.copy(config)
+        treeConfig.noiseSource = noiseSource
+        # Each tree records its own stats, since trees trained in other processes cannot add to config.stats.
+        treeConfig.stats = None if config.stats is None else instrumentation.TrainingStats()
+        # The paths of each tree are counted over a different partition, so they cannot share a count cache.
+        treeConfig.countCache = None
+        jobs.append((partition, treeConfig))
+
+    if workers <= 1:
+        _initializeWorker(datasetConfig)
+        results = [ _trainTree(job) for job in jobs ]
+    else:
+        with shareddataset.publishDataset(datasetConfig) as sharedDataset:
+            with ProcessPoolExecutor(workers, initializer=_initializeWorker, initargs=(sharedDataset.handle,)) as executor:
+                results = list(executor.map(_trainTree, jobs))
+
+    if config.stats is not None:
+        for tree, treeStats in results:
+            config.stats.merge(treeStats)
+    return DPForest([ tree for tree, treeStats in results ], vote)
@@ -1,10 +1,14 @@
 import math
-import random
 import re
+import time
 
 import pandas as pd
 import numpy as np
 
+import countcache
+import counting
+import datasets
+import noise
 import treenode
 
 def entropy(dataframe, classColumn):
@@ -49,6 +53,27 @@ def informationGain(dataframe, attributeName, classColumn):
 
     return initalEntropy
 
+def informationGains(dataframe, attributeColumns, classColumn):
+    '''
+    This function calculates the same information gain as informationGain for several attributes at once,
+    using a single count table of the dataframe instead of filtering it once per attribute value.
+
+    Parameters:
+        dataframe - A pandas dataframe containing the data to calculate information gain on
+        attributeColumns - The names of the columns that you want to calculate the information gain of splitting on
+        classColumn - The name of the column that specifies the class value for this decision tree
+    Returns:
+        A dictionary mapping from column name to information gain
+    '''
+
+    attributeMap = { attributeName: [] for attributeName in attributeColumns }
+    datasetConfig = datasets.encodeDataframe(dataframe, attributeMap, classColumn, [])
+    arities = [ len(datasetConfig.valueLabels[attributeName]) for attributeName in datasetConfig.attributes ]
+    classCounts = np.bincount(datasetConfig.classCodes, minlength=len(datasetConfig.classLabels))
+    _, valueClassCounts = counting.countAttributeValueClasses(datasetConfig.matrix, datasetConfig.classCodes, arities, len(classCounts))
+    gains = counting.informationGains(valueClassCounts, classCounts, arities)
+    return dict(zip(datasetConfig.attributes, gains))
+
 def ID3(dataframe, attributeColumns, classColumn):
     '''
     Run the ID3 decision tree training algorithm on a dataset.
@@ -64,43 +89,162 @@ def ID3(dataframe, attributeColumns, classColumn):
         A TreeNode object containing a decision tree that classifies rows in the data
     '''
 
+    attributeMap = { attributeName: [] for attributeName in attributeColumns }
+    datasetConfig = datasets.encodeDataframe(dataframe, attributeMap, classColumn, [])
+    return trainID3(datasetConfig)
+
+def trainID3(datasetConfig, rows=None):
+    '''
+    Run the ID3 decision tree training algorithm on the integer-coded matrix of a dataset.
+
+    (No privacy measures are taken here.)
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        rows - Optionally, the indices of the rows to train on.  All rows are used by default
+    Returns:
+        A TreeNode object containing a decision tree that classifies rows in the data
+    '''
+    columns = list(range(len(datasetConfig.attributes)))
+    return buildSubtree("ID3", datasetConfig, None, _trainingRows(datasetConfig, rows), columns, 0)
+
+def _ID3Node(datasetConfig, rows, columns):
+    # Decides one node for _buildTree.
+    # rows holds the indices of the rows that reached this node, and columns are the matrix columns of the remaining attributes.
+    classCounts = np.bincount(datasetConfig.classCodes[rows], minlength=len(datasetConfig.classLabels))
+
     # Base cases:
     # If no attributes are left, return a leaf node with the majority class value in the dataframe.
-    valueCounts = dataframe[classColumn].value_counts()
-    if len(attributeColumns) == 0:
+    if len(columns) == 0:
         # Determine the majority class in the dataframe.
-        majorityClass = valueCounts.idxmax()
+        majorityClass = datasetConfig.classLabels[np.argmax(classCounts)]
         # The True in the tuple here indicates that it is a leaf node.
-        return treenode.TreeNode((True, majorityClass))
+        return treenode.TreeNode((True, majorityClass)), [], None
 
     # Next, if all data in the dataframe has the same class value, return a leaf node with the remaining class value.
-    if len(valueCounts) == 1:
-        onlyRemainingClass = valueCounts.index[0]
+    if np.count_nonzero(classCounts) == 1:
+        onlyRemainingClass = datasetConfig.classLabels[np.argmax(classCounts)]
         # The True in the tuple here indicates that it is a leaf node.
-        return treenode.TreeNode((True, onlyRemainingClass))
+        return treenode.TreeNode((True, onlyRemainingClass)), [], None
 
     # Recursive step:
     # Determine the best attribute to classify D
-
-    # This dictionary maps from column name to information gain
-    informationGainForColumn = {}
-    for attributeName in attributeColumns:
-        informationGainForColumn[attributeName] = informationGain(dataframe, attributeName, classColumn)
+    # The information gain of every attribute comes from a single attribute-value x class count table of the node.
+    arities = [ len(datasetConfig.valueLabels[datasetConfig.attributes[column]]) for column in columns ]
+    _, valueClassCounts = counting.countAttributeValueClasses(datasetConfig.matrix[np.ix_(rows, columns)], datasetConfig.classCodes[rows], arities, len(classCounts))
+    informationGainForColumn = counting.informationGains(valueClassCounts, classCounts, arities)
 
     # Choose the attribute that gives the maximum information gain.
-    bestAttribute = max(informationGainForColumn, key=informationGainForColumn.get)
+    bestColumn = columns[np.argmax(informationGainForColumn)]
 
     # The False in the tuple here indicates that it is not a leaf node.
-    node = treenode.TreeNode((False, bestAttribute))
+    node = treenode.TreeNode((False, datasetConfig.attributes[bestColumn]))
 
-    attributeColumnsWithoutBestAttribute = [ attribute for attribute in attributeColumns if attribute != bestAttribute ]
+    columnsWithoutBestAttribute = [ column for column in columns if column != bestColumn ]
     # For all values of the best attribute
-    bestAttributeValueCounts = dataframe[bestAttribute].value_counts()
-    for attributeValue in bestAttributeValueCounts.index:
-        D_a_j = dataframe.loc[dataframe[bestAttribute] == attributeValue ]
-        node.children[attributeValue] = ID3(D_a_j, attributeColumnsWithoutBestAttribute, classColumn)
+    return node, _partitionRows(datasetConfig, rows, bestColumn), columnsWithoutBestAttribute
+
+def _buildTree(nodeOf, rows, columns, depth, offload=None):
+    '''
+    Builds a tree depth first from an explicit stack of work instead of recursion, so deep trees cannot hit the
+    recursion limit.  The nodes are decided in the same order as a recursive builder would decide them.
+
+    Parameters:
+        nodeOf - A function (rows, columns, depth) that decides one node and returns a tuple (node, partitions, childColumns),
+            where partitions is a list of (attributeValue, childRows) tuples for the children of the node (empty for a leaf)
+            and childColumns are the matrix columns that remain for the children
+        rows, columns, depth - The rows, remaining matrix columns and depth of the root
+        offload - Optionally, a function (rows, columns, depth) that is asked about every child before it is built.
+            It returns None to have the child built here, or an object whose result() method returns the child's
+            finished subtree, such as a Future
+    Returns:
+        The root TreeNode
+    '''
+
+    root = None
+    offloaded = []
+    stack = [ (None, None, rows, columns, depth) ]
+    while len(stack) > 0:
+        parent, attributeValue, rows, columns, depth = stack.pop()
+        node, partitions, childColumns = nodeOf(rows, columns, depth)
+        if parent is None:
+            root = node
+        else:
+            parent.children[attributeValue] = node
+
+        children = []
+        for childValue, childRows in partitions:
+            # Every child gets its place in children now, so that the order of children does not depend on when they finish.
+            node.children[childValue] = None
+            subtree = None if offload is None else offload(childRows, childColumns, depth + 1)
+            if subtree is None:
+                children.append((node, childValue, childRows, childColumns, depth + 1))
+            else:
+                offloaded.append((node, childValue, subtree))
+        stack.extend(reversed(children))
+
+    for parent, attributeValue, subtree in offloaded:
+        parent.children[attributeValue] = subtree.result()
+    return root
+
+def buildSubtree(algorithm, datasetConfig, config, rows, columns, depth, offload=None):
+    '''
+    Builds the subtree of one node with the given algorithm.
+
+    Parameters:
+        algorithm - "ID3", "DP_ID3" or "better_DP_ID3"
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        config - An ID3Configuration object.  DP_ID3 uses its maxDepth, epsilon and noiseSource, and ID3 does not use it
+        rows - The indices of the rows of the node.  They are reordered in place.  better_DP_ID3 takes a _PathRows
+            object instead when config.countCache is set
+        columns - The matrix columns of the attributes that have not been split on above the node
+        depth - The depth of the node
+        offload - See _buildTree
+    Returns:
+        The TreeNode of the node
+    '''
 
-    return node
+    if algorithm == "ID3":
+        nodeOf = lambda rows, columns, depth: _ID3Node(datasetConfig, rows, columns)
+    elif algorithm == "DP_ID3":
+        nodeOf = lambda rows, columns, depth: _DPID3Node(datasetConfig, rows, columns, config.maxDepth, config.epsilon, depth, config.noiseSource)
+    elif algorithm == "better_DP_ID3":
+        nodeOf = lambda rows, columns, depth: _betterDPID3Node(datasetConfig, rows, columns, depth, config)
+    else:
+        raise ValueError(f"Unknown algorithm {algorithm!r}")
+    return _buildTree(nodeOf, rows, columns, depth, offload)
+
+def _trainingRows(datasetConfig, rows):
+    # The builders reorder the row indices in place while partitioning them, so they always get their own copy.
+    if rows is None:
+        return np.arange(len(datasetConfig.matrix), dtype=np.int64)
+    return np.array(rows, dtype=np.int64)
+
+def _partitionRows(datasetConfig, rows, column):
+    '''
+    Splits the rows of a node on one attribute without copying any data.
+
+    The row indices are stably sorted in place by their value code, so that each child's rows are a contiguous
+    slice (a view) of the parent's rows.
+
+    Parameters:
+        datasetConfig - The encoded DatasetConfiguration the rows come from
+        rows - A 1D array with the indices of the rows of the node.  It is reordered in place
+        column - The matrix column to split on
+    Returns:
+        A list of (attributeValue, childRows) tuples for every value that occurs in the node, most common first
+    '''
+    labels = datasetConfig.valueLabels[datasetConfig.attributes[column]]
+    codes = datasetConfig.matrix[rows, column]
+    rows[:] = rows[np.argsort(codes, kind="stable")]
+    valueCounts = np.bincount(codes, minlength=len(labels))
+    ends = np.cumsum(valueCounts)
+    partitions = []
+    for code in np.argsort(-valueCounts, kind="stable"):
+        if valueCounts[code] == 0:
+            break
+        partitions.append((labels[code], rows[ends[code] - valueCounts[code]:ends[code]]))
+    return partitions
 
 
 def DP_ID3(dataframe, attributeMap, classColumn, classes, maxDepth, epsilon, currentDepth):
@@ -119,68 +263,90 @@ def DP_ID3(dataframe, attributeMap, classColumn, classes, maxDepth, epsilon, cur
     Returns:
         A TreeNode object containing a decision tree that classifies rows in the data
     '''
+    datasetConfig = datasets.encodeDataframe(dataframe, attributeMap, classColumn, classes)
+    return trainDPID3(datasetConfig, maxDepth, epsilon, currentDepth)
+
+def trainDPID3(datasetConfig, maxDepth, epsilon, currentDepth=0, noiseSource=None, rows=None):
+    '''
+    Run the differentially private ID3 decision tree training algorithm on the integer-coded matrix of a dataset.
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        maxDepth - The maximum depth that the tree can grow to
+        epsilon - The privacy budget for the entire training
+        currentDepth - The depth the returned tree is rooted at
+        noiseSource - The noise source (see the noise module) to draw the noise from.  Unseeded Laplace noise is used by default
+        rows - Optionally, the indices of the rows to train on.  All rows are used by default
+    Returns:
+        A TreeNode object containing a decision tree that classifies rows in the data
+    '''
+    if noiseSource is None:
+        noiseSource = noise.LaplaceNoise()
+    columns = list(range(len(datasetConfig.attributes)))
+    nodeOf = lambda rows, columns, depth: _DPID3Node(datasetConfig, rows, columns, maxDepth, epsilon, depth, noiseSource)
+    return _buildTree(nodeOf, _trainingRows(datasetConfig, rows), columns, currentDepth)
+
+def _DPID3Node(datasetConfig, rows, columns, maxDepth, epsilon, currentDepth, noiseSource):
+    # Decides one node for _buildTree.
+    # rows holds the indices of the rows that reached this node, and columns are the matrix columns of the remaining attributes.
+    classes = datasetConfig.classes
+    arities = [ len(datasetConfig.attributeMap[datasetConfig.attributes[column]]) for column in columns ]
+
     #divides the privacy budget
     epsilon1 = epsilon/(2*(maxDepth+1))
+    epsilon2 = epsilon1/(2*max(len(columns), 1))
+    nodeNoise = _NodeNoise(noiseSource, len(classes), sum(arities), epsilon1, epsilon1, epsilon2)
 
     #Determines the length of the dataframe and add noise
-    numRows = len(dataframe) + np.random.laplace(0, (1/epsilon1))
+    numRows = len(rows) + nodeNoise.rowCount
 
     # Find the max number of values an attribute has
-    maxAttributeValues = 0
-    for attributeName, attributeValues in attributeMap.items():
-        if len(attributeValues) > maxAttributeValues:
-            maxAttributeValues = len(attributeValues)
+    maxAttributeValues = max(arities, default=0)
 
     #Keeps track of whether the maximum depth or number of attributes has been exceeded or
     #if there are too few instances in a class
-    outOfAttributes = len(attributeMap) == 0
-    tooFewPeoplePerClasss = numRows/(maxAttributeValues*len(classes)) < math.sqrt(2)/epsilon1
+    outOfAttributes = len(columns) == 0
+    tooFewPeoplePerClasss = outOfAttributes or numRows/(maxAttributeValues*len(classes)) < math.sqrt(2)/epsilon1
     depthExceeded = maxDepth == currentDepth
 
     if outOfAttributes or tooFewPeoplePerClasss or depthExceeded:
-        maxClass = ("",-10000000000)
         #Counts the number of occurences of each class and adds noise
-        for classValue in classes:
-            lenClass = len(dataframe.loc[dataframe[classColumn] == classValue]) + np.random.laplace(0, (1/epsilon1))
-            if lenClass > maxClass[1]:
-                maxClass = (classValue, lenClass)
+        classCounts = counting.classCounts(datasetConfig.classCodes[rows], len(classes)) + nodeNoise.classCounts
         # The True in the tuple here indicates that it is a leaf node.
-        return treenode.TreeNode((True, maxClass[0]))
+        return treenode.TreeNode((True, classes[np.argmax(classCounts)]), classCounts), [], None
 
     else:
-        #further divides the privacy budget
-        epsilon2 = epsilon1/(2*len(attributeMap))
-        V_aDict = {}
         # Find the attribute that results in the "best" split of the data.
-        for attributeName, attributeValues in attributeMap.items():
-            V_aDict[attributeName] = 0
-            for attributeValue in attributeValues:
-                numAttrValueOccurrences = len(dataframe.loc[dataframe[attributeName] == attributeValue]) + np.random.laplace(0, (1/epsilon2))
-                for classValue in classes:
-                    numAttrValueOccurrencesWithClass = len(dataframe.loc[(dataframe[attributeName] == attributeValue ) \
-                    & (dataframe[classColumn] == classValue)]) + np.random.laplace(0, (1/epsilon2))
-                    # If the number of occurences is 0 or negative, a log could not be calculated with them,
-                    # so we just do nothing by default.
-                    if numAttrValueOccurrences > 0 and numAttrValueOccurrencesWithClass> 0:
-                        V_aDict[attributeName] += numAttrValueOccurrencesWithClass * math.log2(numAttrValueOccurrencesWithClass/numAttrValueOccurrences)
-        bestAttribute = max(V_aDict, key=V_aDict.get)
+        # All of the attribute value and class counts for this node are gathered in a single pass over its rows.
+        valueCounts, valueClassCounts = counting.countAttributeValueClasses(datasetConfig.matrix[np.ix_(rows, columns)], datasetConfig.classCodes[rows], arities, len(classes))
+        V_a = counting.attributeScores(valueCounts + nodeNoise.valueCounts, valueClassCounts + nodeNoise.valueClassCounts, arities)
+        bestColumn = columns[np.argmax(V_a)]
 
         # Create a new internal node indicating the tree will split on that bestAttribute.
         # The False in the tuple here indicates that it is not a leaf node.
-        node = treenode.TreeNode((False, bestAttribute))
+        node = treenode.TreeNode((False, datasetConfig.attributes[bestColumn]))
 
-        attributeColumnsWithoutBestAttribute = {}
-        for key, value in attributeMap.items():
-            if key != bestAttribute:
-                attributeColumnsWithoutBestAttribute[key] = value
+        columnsWithoutBestAttribute = [ column for column in columns if column != bestColumn ]
 
         #For all values of the best attribute
-        bestAttributeValueCounts = dataframe[bestAttribute].value_counts()
-        for attributeValue in bestAttributeValueCounts.index:
-            D_a_j = dataframe.loc[dataframe[bestAttribute] == attributeValue ]
-            node.children[attributeValue] = DP_ID3(D_a_j, attributeColumnsWithoutBestAttribute, classColumn, classes, maxDepth, epsilon, currentDepth+1)
+        return node, _partitionRows(datasetConfig, rows, bestColumn), columnsWithoutBestAttribute
+
+class _NodeNoise:
+    '''
+    All of the noise a node can need, drawn from the noise source with one vectorized call:
+        rowCount - the noise for the number of rows in the node
+        classCounts - the noise for each class count, used if the node becomes a leaf
+        valueCounts, valueClassCounts - the noise for the count table, used if the node splits
+    '''
 
-        return node
+    def __init__(self, noiseSource, numClasses, numValues, epsilonRows, epsilonLeaf, epsilonSplit):
+        epsilons = np.repeat([epsilonRows, epsilonLeaf, epsilonSplit], [1, numClasses, numValues * (numClasses + 1)])
+        noise = noiseSource.sample(epsilons)
+        self.rowCount = noise[0]
+        self.classCounts = noise[1:numClasses+1]
+        table = noise[numClasses+1:].reshape(numValues, numClasses + 1)
+        self.valueCounts = table[:, numClasses]
+        self.valueClassCounts = table[:, :numClasses]
 
 def printNoises(prefix, trueValue, epsilon):
     '''
@@ -230,26 +396,39 @@ class ID3Configuration:
         "evenSplit": evenSplit
     }
 
-    def __init__(self):
-        self.maxDepth = 4
-        self.epsilon = 1
-        self.mValue = 2
-        self.aProportion = 0.5
-        self.layerFunction = evenSplit
-
-    def __init__(self, commandLineArgs):
-        self.maxDepth = int(self.processArg(commandLineArgs.maxDepth))
-        self.epsilon = self.processArg(commandLineArgs.epsilon)
-        self.mValue = self.processArg(commandLineArgs.mValue)
-        self.aProportion = self.processArg(commandLineArgs.aProportion)
-        self.layerFunction = ID3Configuration.layerFunctions[commandLineArgs.layerFunction]
+    def __init__(self, commandLineArgs=None, rng=None, noiseSource=None):
+        # rng is the numpy Generator used for every random draw made with this configuration,
+        # including the noise added while training, so seeding it makes a run reproducible.
+        # noiseSource is the mechanism (see the noise module) that adds noise to the count queries during training.
+        # By default it is the one named by the noiseMechanism command line argument, drawing from rng.
+        self.rng = rng if rng is not None else np.random.default_rng()
+        mechanism = getattr(commandLineArgs, "noiseMechanism", "laplace")
+        self.noiseSource = noiseSource if noiseSource is not None else noise.mechanisms[mechanism](self.rng)
+        # stats is an optional instrumentation.TrainingStats object that better_DP_ID3 records what it does in.
+        self.stats = None
+        # countCache is an optional countcache.CountCache (or scoped view of one) that better_DP_ID3 keeps the exact
+        # counts of every tree path in, so that trees trained on the same rows only need fresh noise for repeated paths.
+        self.countCache = None
+
+        if commandLineArgs is None:
+            self.maxDepth = 4
+            self.epsilon = 1
+            self.mValue = 2
+            self.aProportion = 0.5
+            self.layerFunction = evenSplit
+        else:
+            self.maxDepth = int(self.processArg(commandLineArgs.maxDepth))
+            self.epsilon = self.processArg(commandLineArgs.epsilon)
+            self.mValue = self.processArg(commandLineArgs.mValue)
+            self.aProportion = self.processArg(commandLineArgs.aProportion)
+            self.layerFunction = ID3Configuration.layerFunctions[commandLineArgs.layerFunction]
 
     def processArg(self, arg):
         #takes a string in the command line of the form "rand(a,b)" to generate a random value between a and b for a given parameter
         if arg.startswith("rand"):
             randCaptureRegex = r"rand\(([\d.]*),\s*([\d.]*)\)"
             randMin, randMax = re.findall(randCaptureRegex, arg)[0]
-            return(random.uniform(float(randMin), float(randMax)))
+            return(self.rng.uniform(float(randMin), float(randMax)))
         else:
             return float(arg)
 
@@ -270,6 +449,124 @@ def better_DP_ID3(dataframe, attributeMap, classColumn, classes, currentDepth, c
     Returns:
         A TreeNode object containing a decision tree that classifies rows in the data
     '''
+    datasetConfig = datasets.encodeDataframe(dataframe, attributeMap, classColumn, classes)
+    return trainBetterDPID3(datasetConfig, config, currentDepth)
+
+def trainBetterDPID3(datasetConfig, config: ID3Configuration, currentDepth=0, rows=None):
+    '''
+    Run better_DP_ID3 on the integer-coded matrix of a dataset.
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        config - An ID3Configuration object that contains the numerical parameters that adjust how this function works.
+        currentDepth - The depth the returned tree is rooted at
+        rows - Optionally, the indices of the rows to train on.  All rows are used by default
+    Returns:
+        A TreeNode object containing a decision tree that classifies rows in the data
+    '''
+    columns = list(range(len(datasetConfig.attributes)))
+    return buildSubtree("better_DP_ID3", datasetConfig, config, _rootRows(datasetConfig, config, rows), columns, currentDepth)
+
+def _rootRows(datasetConfig, config, rows):
+    # The rows of the root of a better_DP_ID3 tree, as _PathRows when the counts are cached.
+    if config.countCache is not None:
+        return _PathRows(datasetConfig, frozenset(), sourceRows=rows)
+    return _trainingRows(datasetConfig, rows)
+
+class _PathRows:
+    '''
+    The rows that follow a path from the root of a tree, used by better_DP_ID3 when config.countCache is set.
+    The row indices are only found when the counts of the path are not in the cache.
+
+    path - a frozenset of (column, valueCode) conditions
+    '''
+
+    def __init__(self, datasetConfig, path, parent=None, column=None, code=None, sourceRows=None, numRows=None):
+        # The root has no parent, and takes its rows from sourceRows.  Every other path adds column=code to its parent.
+        self.datasetConfig = datasetConfig
+        self.path = path
+        self.parent = parent
+        self.column = column
+        self.code = code
+        self.sourceRows = sourceRows
+        self.numRows = numRows
+        self.rows = None
+        self.rowsOfChildren = None
+
+    def __len__(self):
+        return self.numRows if self.numRows is not None else len(self.get())
+
+    def get(self):
+        '''
+        Returns the indices of the rows, finding them the first time.
+        '''
+        if self.rows is None:
+            if self.parent is None:
+                self.rows = _trainingRows(self.datasetConfig, self.sourceRows)
+            else:
+                self.rows = self.parent.partition(self.column)[self.code]
+        return self.rows
+
+    def partition(self, column):
+        # Splits the rows by their code in column, as views of one sorted array like _partitionRows.
+        if self.rowsOfChildren is None:
+            rows = self.get()
+            codes = self.datasetConfig.matrix[rows, column]
+            rows[:] = rows[np.argsort(codes, kind="stable")]
+            valueCounts = np.bincount(codes, minlength=len(self.datasetConfig.valueLabels[self.datasetConfig.attributes[column]]))
+            ends = np.cumsum(valueCounts)
+            self.rowsOfChildren = { code: rows[ends[code] - valueCounts[code]:ends[code]] for code in np.flatnonzero(valueCounts) }
+        return self.rowsOfChildren
+
+    def children(self, column, labelCounts):
+        '''
+        Returns a list of (attributeValue, childPathRows) tuples for every value of column that occurs in the rows,
+        most common first like _partitionRows.  labelCounts is the number of rows with each value code.
+        '''
+        labels = self.datasetConfig.valueLabels[self.datasetConfig.attributes[column]]
+        children = []
+        for code in np.argsort(-labelCounts, kind="stable"):
+            if labelCounts[code] == 0:
+                break
+            children.append((labels[code], _PathRows(self.datasetConfig, self.path | {(column, int(code))}, self, column, int(code), numRows=int(labelCounts[code]))))
+        return children
+
+def _pathCounts(countCache, rows):
+    # Looks up the counts of a _PathRows, adding an entry for them if they are not in the cache.
+    pathCounts = countCache.get(rows.path)
+    if pathCounts is None:
+        pathCounts = countcache.PathCounts(len(rows.get()))
+        countCache.put(rows.path, pathCounts)
+    return pathCounts
+
+def _pathClassCounts(datasetConfig, rows, pathCounts):
+    if pathCounts.classCounts is None:
+        pathCounts.classCounts = counting.classCounts(datasetConfig.classCodes[rows.get()], len(datasetConfig.classes))
+    return pathCounts.classCounts
+
+def _pathValueCounts(datasetConfig, rows, columns, pathCounts):
+    # Counts every value label of the remaining attributes in one pass, and keeps the listed values for the split scores.
+    if pathCounts.valueCounts is None:
+        pathRows = rows.get()
+        labelArities = [ len(datasetConfig.valueLabels[datasetConfig.attributes[column]]) for column in columns ]
+        valueCounts, valueClassCounts = counting.countAttributeValueClasses(datasetConfig.matrix[np.ix_(pathRows, columns)], datasetConfig.classCodes[pathRows], labelArities, len(datasetConfig.classes))
+        offsets = np.concatenate(([0], np.cumsum(labelArities)[:-1])).astype(np.int64)
+        listed = np.concatenate([ offset + np.arange(len(datasetConfig.attributeMap[datasetConfig.attributes[column]])) for offset, column in zip(offsets, columns) ] + [np.empty(0, dtype=np.int64)])
+        pathCounts.valueCounts = valueCounts[listed]
+        pathCounts.valueClassCounts = valueClassCounts[listed]
+        pathCounts.labelCounts = np.split(valueCounts, np.cumsum(labelArities)[:-1])
+    return pathCounts.valueCounts, pathCounts.valueClassCounts
+
+def _betterDPID3Node(datasetConfig, rows, columns, currentDepth, config):
+    # Decides one node for _buildTree.
+    # rows holds the indices of the rows that reached this node, and columns are the matrix columns of the remaining attributes.
+    # When config.countCache is set, rows is a _PathRows object instead, and the exact counts come from the cache when they can.
+    stats = config.stats
+    countCache = config.countCache
+    if stats is not None:
+        startTime = time.perf_counter()
+    classes = datasetConfig.classes
+    arities = [ len(datasetConfig.attributeMap[datasetConfig.attributes[column]]) for column in columns ]
 
     # m is the scaling parameter
     m = config.mValue
@@ -278,68 +575,67 @@ def better_DP_ID3(dataframe, attributeMap, classColumn, classes, currentDepth, c
     epsilonThisLayer = config.layerFunction(m, n, d) * config.epsilon
     epsilon1 = epsilonThisLayer * config.aProportion
     epsilonRest = epsilonThisLayer - epsilon1
+    #further divides the privacy budget equally for each attribute
+    epsilon2 = epsilonRest/(2*max(len(columns), 1))
+    nodeNoise = _NodeNoise(config.noiseSource, len(classes), sum(arities), epsilon1, epsilonRest, epsilon2)
 
     # Determine the length of the dataframe and add noise
-    #printNoises("A: ", len(dataframe), epsilon1)
-    numRows = len(dataframe) + np.random.laplace(0, (1/epsilon1))
+    #printNoises("A: ", len(rows), epsilon1)
+    if countCache is None:
+        rowCount = len(rows)
+    else:
+        pathCounts = _pathCounts(countCache, rows)
+        rowCount = pathCounts.numRows
+    numRows = rowCount + nodeNoise.rowCount
 
     # Find the max number of values the remaining attributes have
-    maxAttributeValues = 0
-    for attributeName, attributeValues in attributeMap.items():
-        if len(attributeValues) > maxAttributeValues:
-            maxAttributeValues = len(attributeValues)
+    maxAttributeValues = max(arities, default=0)
 
     #Keeps track of whether the maximum depth or number of attributes has been exceeded or
     #if there are too few instances in a class
-    outOfAttributes = len(attributeMap) == 0
-    tooFewPeoplePerClasss = numRows/(maxAttributeValues*len(classes)) < math.sqrt(2)/epsilon1
+    outOfAttributes = len(columns) == 0
+    tooFewPeoplePerClasss = outOfAttributes or numRows/(maxAttributeValues*len(classes)) < math.sqrt(2)/epsilon1
     depthExceeded = config.maxDepth == currentDepth
 
     if outOfAttributes or tooFewPeoplePerClasss or depthExceeded:
-        maxClass = ("",-10000000000)
         #Counts the number of occurences of each class and adds noise
-        for classValue in classes:
-            #printNoises("D: ", len(dataframe.loc[dataframe[classColumn] == classValue]), epsilon1)
-            lenClass = len(dataframe.loc[dataframe[classColumn] == classValue]) + np.random.laplace(0, (1/epsilonRest))
-            if lenClass > maxClass[1]:
-                maxClass = (classValue, lenClass)
+        if countCache is None:
+            rowsScanned = rowCount
+            classCounts = counting.classCounts(datasetConfig.classCodes[rows], len(classes)) + nodeNoise.classCounts
+        else:
+            rowsScanned = rowCount if pathCounts.classCounts is None else 0
+            classCounts = _pathClassCounts(datasetConfig, rows, pathCounts) + nodeNoise.classCounts
+        if stats is not None:
+            leafReason = "outOfAttributes" if outOfAttributes else "depthExceeded" if depthExceeded else "tooFewRows"
+            stats.addNodes(currentDepth, epsilonThisLayer, rowsScanned, 1 + len(classes), leafReason=leafReason)
+            stats.atDepth(currentDepth).seconds += time.perf_counter() - startTime
         # The True in the tuple here indicates that it is a leaf node.
-        return treenode.TreeNode((True, maxClass[0]))
+        return treenode.TreeNode((True, classes[np.argmax(classCounts)]), classCounts), [], None
 
     else:
-        #further divides the privacy budget equally for each attribute
-        epsilon2 = epsilonRest/(2*len(attributeMap))
-        V_aDict = {}
         # Find the attribute that results in the "best" split of the data.
-        for attributeName, attributeValues in attributeMap.items():
-            V_aDict[attributeName] = 0
-            for attributeValue in attributeValues:
-                #printNoises("B: ", len(dataframe.loc[dataframe[attributeName] == attributeValue]), epsilon2)
-                numAttrValueOccurrences = len(dataframe.loc[dataframe[attributeName] == attributeValue]) + np.random.laplace(0, (1/epsilon2))
-                for classValue in classes:
-                    #printNoises("C: ", len(dataframe.loc[(dataframe[attributeName] == attributeValue ) & (dataframe[classColumn] == classValue)]), epsilon2)
-                    numAttrValueOccurrencesWithClass = len(dataframe.loc[(dataframe[attributeName] == attributeValue ) \
-                    & (dataframe[classColumn] == classValue)]) + np.random.laplace(0, (1/epsilon2))
-                    # If the number of occurences is 0 or negative, a log could not be calculated with them,
-                    # so we just do nothing by default.
-                    if numAttrValueOccurrences > 0 and numAttrValueOccurrencesWithClass> 0:
-                        V_aDict[attributeName] += numAttrValueOccurrencesWithClass * math.log2(numAttrValueOccurrencesWithClass/numAttrValueOccurrences)
-        bestAttribute = max(V_aDict, key=V_aDict.get)
+        # All of the attribute value and class counts for this node are gathered in a single pass over its rows.
+        if countCache is None:
+            rowsScanned = rowCount
+            valueCounts, valueClassCounts = counting.countAttributeValueClasses(datasetConfig.matrix[np.ix_(rows, columns)], datasetConfig.classCodes[rows], arities, len(classes))
+        else:
+            rowsScanned = rowCount if pathCounts.valueCounts is None else 0
+            valueCounts, valueClassCounts = _pathValueCounts(datasetConfig, rows, columns, pathCounts)
+        V_a = counting.attributeScores(valueCounts + nodeNoise.valueCounts, valueClassCounts + nodeNoise.valueClassCounts, arities)
+        bestColumn = columns[np.argmax(V_a)]
 
         # Create a new internal node indicating the tree will split on that bestAttribute.
         # The False in the tuple here indicates that it is not a leaf node.
-        node = treenode.TreeNode((False, bestAttribute))
+        node = treenode.TreeNode((False, datasetConfig.attributes[bestColumn]))
 
-        attributeColumnsWithoutBestAttribute = {}
-        for key, value in attributeMap.items():
-            if key != bestAttribute:
-                attributeColumnsWithoutBestAttribute[key] = value
+        columnsWithoutBestAttribute = [ column for column in columns if column != bestColumn ]
+        if countCache is None:
+            partitions = _partitionRows(datasetConfig, rows, bestColumn)
+        else:
+            partitions = rows.children(bestColumn, pathCounts.labelCounts[columns.index(bestColumn)])
+        if stats is not None:
+            stats.addNodes(currentDepth, epsilonThisLayer, rowsScanned, 1 + sum(arities) * (len(classes) + 1))
+            stats.atDepth(currentDepth).seconds += time.perf_counter() - startTime
 
         #For all values of the best attribute
-        bestAttributeValueCounts = dataframe[bestAttribute].value_counts()
-        for attributeValue in bestAttributeValueCounts.index:
-            D_a_j = dataframe.loc[dataframe[bestAttribute] == attributeValue ]
-            node.children[attributeValue] = better_DP_ID3(D_a_j, attributeColumnsWithoutBestAttribute, classColumn, classes, currentDepth+1, config)
-
-        return node
-
+        return node, partitions, columnsWithoutBestAttribute
@@ -0,0 +1,248 @@
+#===============================================================================
+# Incremental updates of better_DP_ID3 trees.
+#
+# The structure of a tree is trained once.  After that, new rows are only sent
+# down the existing tree: they are added to exact per-node class counts, and the
+# leaf labels are re-released from noisy counts of the new rows alone.  The rows
+# of each batch are disjoint from the rows already released, so every row is
+# only ever spent on once, and a refresh costs time in proportion to the batch.
+# The structure is only retrained when a rebuild is asked for.
+#===============================================================================
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import datasets
+import id3
+import models
+import noise
+import treenode
+
+class IncrementalTree:
+    '''
+    A better_DP_ID3 tree whose leaf labels can be refreshed with new rows without retraining it.
+
+    tree - The CompiledTree.  Its nodeCounts are the noisy class counts released so far, and its nodeClass the labels chosen from them
+    exactCounts - An array of shape (nodes, class labels) with the exact number of rows of each class that reached each node.
+        These counts are private: they are kept to update the tree, and are never released
+    config - The ID3Configuration the tree was trained with.  Its budget rules decide the noise of each leaf
+    classes - The classes a leaf can predict, which are the first class labels of the tree
+    classColumn - The column of new rows that holds the class
+    columnNames - The columns of the dataset the tree was trained on in their original order, for reading new rows from files without a header
+    '''
+
+    def __init__(self, tree, exactCounts, config, classes, classColumn, columnNames):
+        self.tree = tree
+        self.exactCounts = exactCounts
+        self.config = config
+        self.classes = list(classes)
+        self.classColumn = classColumn
+        self.columnNames = list(columnNames)
+
+        # Nodes are numbered breadth-first, so every parent comes before its children.
+        numNodes = len(tree.splitColumn)
+        self.parents = np.full(numNodes, -1, dtype=np.int64)
+        self.depths = np.zeros(numNodes, dtype=np.int64)
+        for node in range(numNodes):
+            children = tree.childTable[node][tree.childTable[node] >= 0]
+            self.parents[children] = node
+            self.depths[children] = self.depths[node] + 1
+        self.leaves = np.flatnonzero(tree.splitColumn < 0)
+
+    def leafEpsilons(self):
+        '''
+        Returns the privacy budget of the class counts of each leaf, which better_DP_ID3 gives a leaf at its depth:
+        the part of the layer's budget that is left after the first count query.
+        '''
+        config = self.config
+        return np.array([ config.layerFunction(config.mValue, depth, config.maxDepth + 1) * config.epsilon * (1 - config.aProportion)
+                          for depth in self.depths[self.leaves] ])
+
+    def encodeRows(self, dataframe):
+        '''
+        Encodes the rows of a dataframe with the value and class codes of the tree.
+        The numbers of numeric attributes are put in the bins the tree was trained with.
+
+        Returns:
+            A tuple (matrix, classCodes).  Values the tree has never seen get codes it has no child for
+        '''
+        matrix = np.empty((len(dataframe), len(self.tree.attributes)), dtype=np.int64)
+        for column, attribute in enumerate(self.tree.attributes):
+            values = dataframe[attribute]
+            if attribute in self.tree.binEdges:
+                values = datasets.binNumericValues(values, self.tree.binEdges[attribute], self.tree.valueLabels[attribute])
+            matrix[:, column], labels = datasets.encodeColumn(values, self.tree.valueLabels[attribute])
+        classCodes, labels = datasets.encodeColumn(dataframe[self.classColumn], self.tree.classLabels)
+        if len(labels) > len(self.tree.classLabels):
+            raise ValueError(f"The new rows have classes the tree was not trained with: {labels[len(self.tree.classLabels):]}")
+        return matrix, classCodes.astype(np.int64)
+
+    def addRows(self, matrix, classCodes, noiseSource=None):
+        '''
+        Adds rows to the exact counts, and re-releases every leaf label with fresh noise on these rows only.
+
+        The noisy class counts of the new rows of each leaf are added to the ones released before, and each leaf
+        predicts its largest total.  Every leaf gets noise, whether or not any new row reached it.  Rows with a value
+        the tree has no child for stop above the leaves, so they only count toward the exact counts of the nodes they reached.
+
+        Parameters:
+            matrix - A 2D integer array of value codes in the encoding of the tree (see encodeRows)
+            classCodes - The class code of each row
+            noiseSource - The noise source to draw from.  config.noiseSource is used by default
+        Returns:
+            The number of rows that reached a leaf
+        '''
+
+        numNodes, numLabels = self.exactCounts.shape
+        finalNodes = self.tree.leafIndices(matrix)
+        counts = np.bincount(finalNodes.astype(np.int64) * numLabels + classCodes, minlength=numNodes * numLabels).reshape(numNodes, numLabels)
+        reachedLeaves = int(counts[self.leaves].sum())
+        # Walking backwards adds every subtree to its parent after the subtree itself is complete.
+        for node in range(numNodes - 1, 0, -1):
+            counts[self.parents[node]] += counts[node]
+        self.exactCounts += counts
+
+        noiseSource = noiseSource if noiseSource is not None else self.config.noiseSource
+        numClasses = len(self.classes)
+        epsilons = np.repeat(self.leafEpsilons(), numClasses)
+        noisyCounts = counts[self.leaves, :numClasses] + noiseSource.sample(epsilons).reshape(len(self.leaves), numClasses)
+        self.tree.nodeCounts[self.leaves, :numClasses] += noisyCounts
+        self.tree.nodeClass[self.leaves] = np.argmax(self.tree.nodeCounts[self.leaves, :numClasses], axis=1)
+        self._summarizeInternalNodes()
+        return reachedLeaves
+
+    def addDataframe(self, dataframe, noiseSource=None):
+        '''
+        Encodes the rows of a dataframe and adds them with addRows.
+        '''
+        matrix, classCodes = self.encodeRows(dataframe)
+        return self.addRows(matrix, classCodes, noiseSource)
+
+    def _summarizeInternalNodes(self):
+        # Internal nodes get the sums of the leaves below them and the most common leaf class, as in treenode.compileTree.
+        tree = self.tree
+        isLeaf = tree.splitColumn < 0
+        nodeCounts = np.where(isLeaf[:, None], tree.nodeCounts, 0)
+        leafClassCounts = np.zeros((len(isLeaf), len(tree.classLabels)), dtype=np.int64)
+        leafClassCounts[self.leaves, tree.nodeClass[self.leaves]] = 1
+        for node in range(len(isLeaf) - 1, 0, -1):
+            nodeCounts[self.parents[node]] += nodeCounts[node]
+            leafClassCounts[self.parents[node]] += leafClassCounts[node]
+        tree.nodeCounts[:] = nodeCounts
+        tree.nodeClass[~isLeaf] = np.argmax(leafClassCounts[~isLeaf], axis=1)
+
+    def rebuild(self, datasetConfig, rows=None):
+        '''
+        Retrains the structure of the tree from scratch on a dataset, with the same configuration.
+        This spends the whole budget on the rows again, so it should only be done when the structure is out of date.
+
+        Returns:
+            A new IncrementalTree
+        '''
+        return trainIncremental(datasetConfig, self.config, rows)
+
+def trainIncremental(datasetConfig, config, rows=None):
+    '''
+    Trains a better_DP_ID3 tree and keeps the exact counts that later updates need.
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        config - An ID3Configuration object that contains the numerical parameters of the training
+        rows - Optionally, the indices of the rows to train on.  All rows are used by default
+    Returns:
+        An IncrementalTree
+    '''
+    root = id3.trainBetterDPID3(datasetConfig, config, rows=rows)
+    tree = treenode.compileTree(root, datasetConfig)
+    rows = np.arange(len(datasetConfig.matrix)) if rows is None else np.asarray(rows)
+    incrementalTree = IncrementalTree(tree, np.zeros(tree.nodeCounts.shape, dtype=np.int64), config, datasetConfig.classes, datasetConfig.classColumn,
+                                      datasetConfig.dataframeColumns)
+
+    # The training rows are counted without releasing anything new: the labels already came from their noisy counts.
+    matrix = datasetConfig.matrix[rows]
+    numNodes, numLabels = incrementalTree.exactCounts.shape
+    counts = np.bincount(tree.leafIndices(matrix).astype(np.int64) * numLabels + datasetConfig.classCodes[rows], minlength=numNodes * numLabels)
+    counts = counts.reshape(numNodes, numLabels)
+    for node in range(numNodes - 1, 0, -1):
+        counts[incrementalTree.parents[node]] += counts[node]
+    incrementalTree.exactCounts += counts
+    return incrementalTree
+
+def saveIncremental(path, incrementalTree):
+    '''
+    Writes an IncrementalTree to a file.  The file is also a model that models.loadModel can read,
+    but it holds the exact counts, so it has to be kept as private as the data.
+    '''
+    config = incrementalTree.config
+    layerFunctionName = next(name for name, function in id3.ID3Configuration.layerFunctions.items() if function is config.layerFunction)
+    mechanismName = next((name for name, mechanism in noise.mechanisms.items() if isinstance(config.noiseSource, mechanism)), "laplace")
+    models.saveModel(path, incrementalTree.tree, {
+        "incremental_exactCounts": incrementalTree.exactCounts,
+        "incremental_parameters": np.array([config.maxDepth, config.epsilon, config.mValue, config.aProportion], dtype=float),
+        "incremental_layerFunction": np.array(layerFunctionName),
+        "incremental_noiseMechanism": np.array(mechanismName),
+        "incremental_classes": np.array(incrementalTree.classes, dtype=str),
+        "incremental_classColumn": np.array(incrementalTree.classColumn),
+        "incremental_columnNames": np.array(incrementalTree.columnNames, dtype=str),
+    })
+
+def loadIncremental(path, rng=None):
+    '''
+    Reads an IncrementalTree written by saveIncremental.
+
+    Parameters:
+        path - The .npz file
+        rng - The numpy Generator the noise of later updates is drawn from
+    '''
+    tree = models.loadModel(path)
+    with np.load(path, allow_pickle=False) as arrays:
+        if "incremental_exactCounts" not in arrays:
+            raise ValueError(f"{path} is a model without the counts needed for incremental updates")
+        maxDepth, epsilon, mValue, aProportion = arrays["incremental_parameters"]
+        arguments = argparse.Namespace(maxDepth=str(int(maxDepth)), epsilon=str(epsilon), mValue=str(mValue), aProportion=str(aProportion),
+                                       layerFunction=str(arrays["incremental_layerFunction"]), noiseMechanism=str(arrays["incremental_noiseMechanism"]))
+        config = id3.ID3Configuration(arguments, rng)
+        return IncrementalTree(tree, arrays["incremental_exactCounts"].astype(np.int64), config,
+                               arrays["incremental_classes"].tolist(), str(arrays["incremental_classColumn"]),
+                               arrays["incremental_columnNames"].tolist())
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a better_DP_ID3 tree once, then refresh its leaf labels from new rows without retraining it.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    trainParser = subparsers.add_parser("train", help="train the structure of a tree on a dataset.  Run it again on all the data to rebuild the structure")
+    trainParser.add_argument("state", help="the .npz file to save the tree and its exact counts to")
+    trainParser.add_argument("-d", "--dataset", default="mushroom", choices=datasets.choices.keys(), help="the dataset to train on")
+    trainParser.add_argument("--maxDepth", default="4", help="the maximum depth the tree can grow to")
+    trainParser.add_argument("--epsilon", default="1", help="the privacy budget to use for the tree")
+    trainParser.add_argument("--mValue", default="2", help="the scaling factor to use in the layerFunction. Must be greater than 1")
+    trainParser.add_argument("--aProportion", default="0.5", help="the proportion of the privacy budget at each layer to give to the first count query.  Must be between 0 and 1.")
+    trainParser.add_argument("--layerFunction", default="evenSplit", choices=id3.ID3Configuration.layerFunctions.keys(), help="the function to use which determines how much budget each layer gets")
+    trainParser.add_argument("--noiseMechanism", default="laplace", choices=noise.mechanisms.keys(), help="the mechanism that adds noise to the count queries")
+
+    updateParser = subparsers.add_parser("update", help="add new rows to a trained tree and re-release its leaf labels")
+    updateParser.add_argument("state", help="the file written by train.  It is updated in place")
+    updateParser.add_argument("rows", help="a CSV file with the new rows")
+    updateParser.add_argument("--header", action="store_true", help="the first line of the CSV file names the columns.  Otherwise they are in the order of the dataset the tree was trained on")
+
+    for subparser in (trainParser, updateParser):
+        subparser.add_argument("--model", default=None, help="also save the tree alone, without the exact counts, as a model to serve")
+        subparser.add_argument("--seed", type=int, default=None, help="the seed for all random draws, so that a run can be reproduced")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.command == "train":
+        incrementalTree = trainIncremental(datasets.choices[args.dataset](), id3.ID3Configuration(args, rng))
+    else:
+        incrementalTree = loadIncremental(args.state, rng)
+        columnNames = None if args.header else incrementalTree.columnNames
+        reachedLeaves = incrementalTree.addDataframe(pd.read_csv(args.rows, dtype=str, names=columnNames))
+        print(f"{reachedLeaves} new rows reached a leaf")
+
+    saveIncremental(args.state, incrementalTree)
+    if args.model is not None:
+        models.saveModel(args.model, incrementalTree.tree)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+class DepthStats:
+    '''
+    What training did at one depth of a tree.
+
+    seconds - wall time spent at this depth, not counting the depths below it
+    queries - the number of noisy count queries whose answers were used
+    rowsScanned - the number of rows counted
+    nodes - the number of nodes created
+    leaves - a dictionary from each of TrainingStats.leafReasons to the number of leaves created for that reason
+    epsilon - the privacy budget the layerFunction gives this depth
+    '''
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.rowsScanned = 0
+        self.nodes = 0
+        self.leaves = { reason: 0 for reason in TrainingStats.leafReasons }
+        self.epsilon = 0.0
+
+class TrainingStats:
+    '''
+    Records where the time and privacy budget of training go, one DepthStats per depth.
+
+    Training is only instrumented when an ID3Configuration has a TrainingStats object as its stats attribute.
+    It is None by default, which costs one attribute check per node.
+
+    Leaves are attributed to the first reason that applies:
+        outOfAttributes - every attribute was already split on above the leaf
+        depthExceeded - the leaf is at maxDepth
+        tooFewRows - the noisy row count was too small for a split to be trusted
+    '''
+
+    leafReasons = ["outOfAttributes", "depthExceeded", "tooFewRows"]
+    columnNames = ["trainingSeconds", "countQueries", "rowsScanned", "nodes", "depth",
+                   "leavesOutOfAttributes", "leavesDepthExceeded", "leavesTooFewRows", "epsilonSpent"]
+
+    def __init__(self):
+        self.depths = []
+
+    def atDepth(self, depth):
+        '''
+        Returns the DepthStats of a depth, creating the ones that do not exist yet.
+        '''
+        while len(self.depths) <= depth:
+            self.depths.append(DepthStats())
+        return self.depths[depth]
+
+    def addNodes(self, depth, epsilon, rowsScanned, queries, nodes=1, leafReason=None):
+        '''
+        Records nodes created at a depth.
+
+        Parameters:
+            depth - the depth of the nodes
+            epsilon - the privacy budget of the depth
+            rowsScanned - the number of rows counted to decide the nodes
+            queries - the number of noisy count queries whose answers were used
+            nodes - the number of nodes
+            leafReason - one of leafReasons if the nodes are leaves, otherwise None
+        '''
+        depthStats = self.atDepth(depth)
+        depthStats.epsilon = epsilon
+        depthStats.rowsScanned += rowsScanned
+        depthStats.queries += queries
+        depthStats.nodes += nodes
+        if leafReason is not None:
+            depthStats.leaves[leafReason] += nodes
+
+    def merge(self, other):
+        '''
+        Adds the records of another TrainingStats, such as the one of another tree of a forest.
+        The trees of a forest are trained on disjoint rows, so the epsilon of each depth is the largest of the two.
+        '''
+        for depth, otherStats in enumerate(other.depths):
+            depthStats = self.atDepth(depth)
+            depthStats.seconds += otherStats.seconds
+            depthStats.queries += otherStats.queries
+            depthStats.rowsScanned += otherStats.rowsScanned
+            depthStats.nodes += otherStats.nodes
+            for reason in TrainingStats.leafReasons:
+                depthStats.leaves[reason] += otherStats.leaves[reason]
+            depthStats.epsilon = max(depthStats.epsilon, otherStats.epsilon)
+
+    def summary(self):
+        '''
+        Returns a list with the totals over all depths, with one value for each of the columns in columnNames.
+        If nothing was recorded, because the algorithm is not instrumented, every value is None.
+        '''
+        if len(self.depths) == 0:
+            return [None] * len(TrainingStats.columnNames)
+        return [
+            sum(depthStats.seconds for depthStats in self.depths),
+            sum(depthStats.queries for depthStats in self.depths),
+            sum(depthStats.rowsScanned for depthStats in self.depths),
+            sum(depthStats.nodes for depthStats in self.depths),
+            len(self.depths) - 1,
+        ] + [ sum(depthStats.leaves[reason] for depthStats in self.depths) for reason in TrainingStats.leafReasons ] + [
+            sum(depthStats.epsilon for depthStats in self.depths),
+        ]
@@ -0,0 +1,256 @@
+import math
+import time
+
+import numpy as np
+
+import counting
+import instrumentation
+import treenode
+
+class _FrontierNode:
+    '''
+    A node at the current depth whose type (leaf or split) has not been decided yet.
+
+    treeNode - the TreeNode that will be filled in once the node is decided
+    remaining - a boolean array marking the matrix columns that have not been split on above this node
+    '''
+
+    def __init__(self, treeNode, remaining):
+        self.treeNode = treeNode
+        self.remaining = remaining
+
+class LevelWiseBuilder:
+    '''
+    Builds a better_DP_ID3 tree breadth-first, one whole depth at a time.
+
+    Every node at a depth gets the same layer budget from config.layerFunction, so the counts of all of the frontier
+    nodes can be gathered in one grouped pass over the rows, and the noise for all of them drawn in one call.
+    Each node makes exactly the same noisy count queries, with the same budgets, as id3._betterDPID3Node would.
+
+    Usage: while frontier is not empty, sum countFrontier over all of the rows that are still in the tree,
+    pass the sum to expandFrontier, and move the rows to the next depth with routeRows.
+    '''
+
+    def __init__(self, datasetConfig, config):
+        '''
+        Parameters:
+            datasetConfig - A DatasetConfiguration providing attributes, attributeMap, valueLabels and classes.
+                Its matrix is not used, so it may be empty
+            config - An ID3Configuration object that contains the numerical parameters of the training
+        '''
+        self.attributes = list(datasetConfig.attributes)
+        self.valueLabels = [ datasetConfig.valueLabels[attribute] for attribute in self.attributes ]
+        self.classes = list(datasetConfig.classes)
+        self.config = config
+
+        self.listedArities = np.array([ len(datasetConfig.attributeMap[attribute]) for attribute in self.attributes ], dtype=np.int64)
+        self.labelArities = np.array([ len(labels) for labels in self.valueLabels ], dtype=np.int64)
+        self.labelOffsets = np.concatenate(([0], np.cumsum(self.labelArities)[:-1])).astype(np.int64)
+        self.totalLabels = int(self.labelArities.sum())
+        # The positions in the count table of the values listed in attributeMap, which are the ones the split scores use.
+        self.listedPositions = np.concatenate([ offset + np.arange(arity) for offset, arity in zip(self.labelOffsets, self.listedArities) ] + [np.empty(0, dtype=np.int64)])
+
+        self.root = treenode.TreeNode(None)
+        self.frontier = [ _FrontierNode(self.root, np.ones(len(self.attributes), dtype=bool)) ]
+        self.depth = 0
+        self.routing = None
+        self.splitColumns = None
+
+    def countFrontier(self, matrix, classCodes, nodeOfRow):
+        '''
+        Counts the rows of every frontier node in one grouped pass.
+
+        Parameters:
+            matrix - The integer-coded rows that are still in the tree
+            classCodes - The class codes of those rows
+            nodeOfRow - The index in frontier of the node each row is at
+        Returns:
+            An array of shape (len(frontier), totalLabels + 1, len(classes) + 1).  Entry [f, j, c] is the number of rows
+            at node f with the j-th attribute value and class c.  The last value row holds the class counts of the
+            whole node, and the last class column counts rows whose class is not in classes.
+            The counts of several chunks of rows can simply be added together.
+        '''
+        numClasses = len(self.classes)
+        numNodes = len(self.frontier)
+        numCells = numNodes * (self.totalLabels + 1) * (numClasses + 1)
+        indexType = counting.indexDtype(numCells)
+        labelOffsets = self.labelOffsets.astype(indexType)
+
+        # The rows are counted a chunk at a time, so the temporary index arrays stay small next to the matrix.
+        counts = np.zeros(numCells, dtype=np.int64)
+        chunkRows = max(1, counting.chunkCells // (len(self.attributes) + 1))
+        cellIndex = np.empty((min(chunkRows, len(matrix)), len(self.attributes) + 1), dtype=indexType)
+        for start in range(0, len(matrix), chunkRows):
+            end = min(start + chunkRows, len(matrix))
+            chunkIndex = cellIndex[:end - start]
+            classSlots = np.where(classCodes[start:end] < numClasses, classCodes[start:end], numClasses).astype(indexType)
+            nodeBase = nodeOfRow[start:end].astype(indexType) * (self.totalLabels + 1)
+            chunkIndex[:, :-1] = (nodeBase[:, np.newaxis] + labelOffsets + matrix[start:end]) * (numClasses + 1) + classSlots[:, np.newaxis]
+            chunkIndex[:, -1] = (nodeBase + self.totalLabels) * (numClasses + 1) + classSlots
+            counts += np.bincount(chunkIndex.ravel(), minlength=numCells)
+        return counts.reshape(numNodes, self.totalLabels + 1, numClasses + 1)
+
+    def expandFrontier(self, counts):
+        '''
+        Turns every frontier node into a leaf or a split from its counts, and replaces the frontier with the next depth.
+
+        Parameters:
+            counts - The counts of all of the rows in the tree, as returned by countFrontier
+        '''
+        config = self.config
+        numClasses = len(self.classes)
+        numNodes = len(self.frontier)
+        numListed = len(self.listedPositions)
+
+        # m is the scaling parameter
+        m = config.mValue
+        n = self.depth
+        d = config.maxDepth+1
+        epsilonThisLayer = config.layerFunction(m, n, d) * config.epsilon
+        epsilon1 = epsilonThisLayer * config.aProportion
+        epsilonRest = epsilonThisLayer - epsilon1
+
+        remaining = np.array([ node.remaining for node in self.frontier ]).reshape(numNodes, len(self.attributes))
+        numRemaining = remaining.sum(axis=1)
+        # further divides the privacy budget equally for each remaining attribute of each node
+        epsilon2 = epsilonRest/(2*np.maximum(numRemaining, 1))
+
+        # All of the noise for the whole depth is drawn with one call.
+        queriesPerNode = 1 + numClasses + numListed * (numClasses + 1)
+        epsilons = np.empty((numNodes, queriesPerNode))
+        epsilons[:, 0] = epsilon1
+        epsilons[:, 1:numClasses+1] = epsilonRest
+        epsilons[:, numClasses+1:] = epsilon2[:, np.newaxis]
+        noise = config.noiseSource.sample(epsilons)
+
+        nodeCounts = counts[:, self.totalLabels, :]
+        numRows = nodeCounts.sum(axis=1) + noise[:, 0]
+        maxAttributeValues = np.where(remaining, self.listedArities, 0).max(axis=1, initial=0)
+
+        outOfAttributes = numRemaining == 0
+        tooFewPeoplePerClasss = outOfAttributes | (numRows < math.sqrt(2)/epsilon1 * maxAttributeValues * numClasses)
+        depthExceeded = config.maxDepth == self.depth
+        isLeaf = outOfAttributes | tooFewPeoplePerClasss | depthExceeded
+
+        noisyClassCounts = nodeCounts[:, :numClasses] + noise[:, 1:numClasses+1]
+        leafClasses = np.argmax(noisyClassCounts, axis=1)
+
+        splitNodes = np.flatnonzero(~isLeaf)
+        if config.stats is not None:
+            self._recordStats(epsilonThisLayer, nodeCounts.sum(axis=1), remaining, outOfAttributes, isLeaf, splitNodes)
+
+        bestColumns = np.full(numNodes, -1, dtype=np.int64)
+        if len(splitNodes) > 0:
+            listedCounts = counts[splitNodes][:, self.listedPositions, :]
+            tableNoise = noise[splitNodes, numClasses+1:].reshape(len(splitNodes), numListed, numClasses + 1)
+            noisyValueCounts = listedCounts.sum(axis=2) + tableNoise[:, :, numClasses]
+            noisyValueClassCounts = listedCounts[:, :, :numClasses] + tableNoise[:, :, :numClasses]
+            scores = counting.attributeScores(noisyValueCounts.reshape(-1), noisyValueClassCounts.reshape(-1, numClasses),
+                                              np.tile(self.listedArities, len(splitNodes))).reshape(len(splitNodes), len(self.attributes))
+            scores[~remaining[splitNodes]] = -np.inf
+            bestColumns[splitNodes] = np.argmax(scores, axis=1)
+
+        nextFrontier = []
+        self.routing = np.full((numNodes, max(int(self.labelArities.max(initial=0)), 1)), -1, dtype=np.int64)
+        for index, frontierNode in enumerate(self.frontier):
+            if isLeaf[index]:
+                # The True in the tuple here indicates that it is a leaf node.
+                frontierNode.treeNode.data = (True, self.classes[leafClasses[index]])
+                frontierNode.treeNode.classCounts = noisyClassCounts[index]
+                continue
+
+            bestColumn = bestColumns[index]
+            # The False in the tuple here indicates that it is not a leaf node.
+            frontierNode.treeNode.data = (False, self.attributes[bestColumn])
+            childRemaining = frontierNode.remaining.copy()
+            childRemaining[bestColumn] = False
+
+            # For all values of the best attribute that occur in the node, most common first
+            offset = self.labelOffsets[bestColumn]
+            valueCounts = counts[index, offset:offset + self.labelArities[bestColumn], :].sum(axis=1)
+            for code in np.argsort(-valueCounts, kind="stable"):
+                if valueCounts[code] == 0:
+                    break
+                child = treenode.TreeNode(None)
+                frontierNode.treeNode.children[self.valueLabels[bestColumn][code]] = child
+                self.routing[index, code] = len(nextFrontier)
+                nextFrontier.append(_FrontierNode(child, childRemaining))
+
+        self.splitColumns = bestColumns
+        self.frontier = nextFrontier
+        self.depth += 1
+
+    def _recordStats(self, epsilonThisLayer, rowCounts, remaining, outOfAttributes, isLeaf, splitNodes):
+        # Records the nodes of the current depth in config.stats, with the same queries as id3._betterDPID3Node makes.
+        stats = self.config.stats
+        numClasses = len(self.classes)
+        depthExceeded = np.full(len(isLeaf), self.config.maxDepth == self.depth)
+        reasons = np.where(outOfAttributes, 0, np.where(depthExceeded, 1, 2))
+        for reasonIndex, reason in enumerate(instrumentation.TrainingStats.leafReasons):
+            leaves = isLeaf & (reasons == reasonIndex)
+            if leaves.any():
+                numLeaves = int(leaves.sum())
+                stats.addNodes(self.depth, epsilonThisLayer, int(rowCounts[leaves].sum()), numLeaves * (1 + numClasses), nodes=numLeaves, leafReason=reason)
+        if len(splitNodes) > 0:
+            queries = len(splitNodes) + int((remaining[splitNodes] * self.listedArities).sum()) * (numClasses + 1)
+            stats.addNodes(self.depth, epsilonThisLayer, int(rowCounts[splitNodes].sum()), queries, nodes=len(splitNodes))
+
+    def routeRows(self, matrix, nodeOfRow):
+        '''
+        Moves rows from the nodes decided by the last expandFrontier call to their child on the new frontier.
+
+        Parameters:
+            matrix - The integer-coded rows
+            nodeOfRow - The index in the old frontier of the node each row was at
+        Returns:
+            The index in the new frontier of the node each row is now at, or -1 for rows that ended in a leaf
+        '''
+        return routeRows(self.splitColumns, self.routing, matrix, nodeOfRow)
+
+def routeRows(splitColumns, routing, matrix, nodeOfRow):
+    '''
+    Moves rows down one depth of a tree built by a LevelWiseBuilder.
+
+    Parameters:
+        splitColumns, routing - The splitColumns and routing of the builder right after expanding that depth
+        matrix - The integer-coded rows
+        nodeOfRow - The index of the node each row is at in the frontier of that depth
+    Returns:
+        The index in the next frontier of the node each row is now at, or -1 for rows that ended in a leaf
+    '''
+    rowSplitColumns = splitColumns[nodeOfRow]
+    inSplit = rowSplitColumns >= 0
+    nextNode = np.full(len(nodeOfRow), -1, dtype=np.int64)
+    codes = matrix[np.flatnonzero(inSplit), rowSplitColumns[inSplit]]
+    nextNode[inSplit] = routing[nodeOfRow[inSplit], codes]
+    return nextNode
+
+def trainBetterDPID3LevelWise(datasetConfig, config, rows=None):
+    '''
+    Run better_DP_ID3 breadth-first, with one pass over the data per depth instead of one per node.
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        config - An ID3Configuration object that contains the numerical parameters that adjust how this function works.
+        rows - Optionally, the indices of the rows to train on.  All rows are used by default
+    Returns:
+        A TreeNode object containing a decision tree that classifies rows in the data
+    '''
+
+    builder = LevelWiseBuilder(datasetConfig, config)
+    activeRows = np.arange(len(datasetConfig.matrix)) if rows is None else np.asarray(rows)
+    nodeOfRow = np.zeros(len(activeRows), dtype=np.int64)
+    while len(builder.frontier) > 0:
+        if config.stats is not None:
+            startTime = time.perf_counter()
+            depth = builder.depth
+        matrix = datasetConfig.matrix[activeRows]
+        builder.expandFrontier(builder.countFrontier(matrix, datasetConfig.classCodes[activeRows], nodeOfRow))
+        nodeOfRow = builder.routeRows(matrix, nodeOfRow)
+        # Rows that ended in a leaf are not looked at again.
+        stillActive = nodeOfRow >= 0
+        activeRows = activeRows[stillActive]
+        nodeOfRow = nodeOfRow[stillActive]
+        if config.stats is not None:
+            config.stats.atDepth(depth).seconds += time.perf_counter() - startTime
+    return builder.root
@@ -0,0 +1,129 @@
+#===============================================================================
+# Load generator for server.py.
+#
+# Opens several connections to a running prediction server and sends it records
+# of a dataset as fast as it answers, then prints the latency and throughput seen
+# by the clients next to the counters reported by the server.
+#===============================================================================
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+import datasets
+
+async def _runConnection(host, port, requests, deadline, pipeline, latencies, lineLimit):
+    # Keeps up to pipeline requests in flight on one connection until the deadline, recording the round trip of each
+    # request the server answered without an error.  Returns the numbers of answered and failed requests.
+    reader, writer = await asyncio.open_connection(host, port, limit=lineLimit)
+    sent = collections.deque()
+    counts = [0, 0]
+
+    async def readResponse():
+        response = json.loads(await reader.readline())
+        sentTime = sent.popleft()
+        if isinstance(response, dict) and "error" in response:
+            counts[1] += 1
+        else:
+            latencies.append(time.perf_counter() - sentTime)
+            counts[0] += 1
+
+    try:
+        for request in requests:
+            if time.perf_counter() >= deadline:
+                break
+            writer.write(request)
+            sent.append(time.perf_counter())
+            if len(sent) >= pipeline:
+                await writer.drain()
+                await readResponse()
+        await writer.drain()
+        while len(sent) > 0:
+            await readResponse()
+    finally:
+        writer.close()
+    return counts
+
+async def _serverStats(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b"stats\n")
+    await writer.drain()
+    stats = json.loads(await reader.readline())
+    writer.close()
+    return stats
+
+def makeRequests(datasetName, recordsPerRequest, model=None, seed=0):
+    '''
+    Builds an endless supply of request lines from the rows of a dataset, in random order.
+
+    Parameters:
+        datasetName - One of datasets.choices
+        recordsPerRequest - The number of records in each request.  1 sends single records
+        model - Optionally, the name of the model the requests are for
+        seed - The seed of the order of the rows
+    Returns:
+        A generator of encoded request lines
+    '''
+    datasetConfig = datasets.choices[datasetName]()
+    records = datasetConfig.dataframe[datasetConfig.attributes].to_dict("records")
+    rng = np.random.default_rng(seed)
+    while True:
+        picked = [ records[i] for i in rng.integers(len(records), size=recordsPerRequest) ]
+        if model is not None:
+            request = { "model": model, "records": picked }
+        else:
+            request = picked[0] if recordsPerRequest == 1 else picked
+        yield json.dumps(request).encode() + b"\n"
+
+async def runLoad(args):
+    '''
+    Runs the load of the parsed command line arguments against the server.
+
+    Returns:
+        A dictionary with the client side counters and the stats reported by the server.  Requests the server answered
+        with an error are only counted in errors, not in the requests, records, throughput or latencies
+    '''
+    deadline = time.perf_counter() + args.duration
+    latencies = []
+    startTime = time.perf_counter()
+    counts = await asyncio.gather(*[
+        _runConnection(args.host, args.port, makeRequests(args.dataset, args.recordsPerRequest, args.model, args.seed + connection),
+                       deadline, args.pipeline, latencies, args.lineLimit)
+        for connection in range(args.connections)
+    ])
+    elapsed = time.perf_counter() - startTime
+    numRequests = sum(answered for answered, failed in counts)
+    return {
+        "client": {
+            "requests": numRequests,
+            "errors": sum(failed for answered, failed in counts),
+            "records": numRequests * args.recordsPerRequest,
+            "p50LatencyMs": float(np.percentile(latencies, 50)) * 1000 if len(latencies) > 0 else None,
+            "p99LatencyMs": float(np.percentile(latencies, 99)) * 1000 if len(latencies) > 0 else None,
+            "requestsPerSecond": numRequests / elapsed,
+            "recordsPerSecond": numRequests * args.recordsPerRequest / elapsed,
+        },
+        "server": await _serverStats(args.host, args.port),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Send prediction requests built from a dataset to a running server.py and report latency and throughput.")
+    parser.add_argument("-d", "--dataset", default="mushroom", choices=datasets.choices.keys(), help="the dataset whose rows are sent as records")
+    parser.add_argument("--host", default="127.0.0.1", help="the address of the server")
+    parser.add_argument("--port", type=int, default=8765, help="the port of the server")
+    parser.add_argument("--model", default=None, help="the model to ask for.  The server's first model is used by default")
+    parser.add_argument("--connections", type=int, default=8, help="the number of concurrent connections")
+    parser.add_argument("--pipeline", type=int, default=1, help="the number of requests each connection keeps in flight")
+    parser.add_argument("--recordsPerRequest", type=int, default=1, help="the number of records in each request")
+    parser.add_argument("--duration", type=float, default=10, help="how long to send requests for, in seconds")
+    parser.add_argument("--lineLimit", type=int, default=1 << 24, help="the longest response line in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the order the records are sent in")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(runLoad(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,11 @@ import argparse
 import pandas as pd
 
 import datasets
-import evaluation
+import experiments
+import forest
 import id3
-import treenode
+import instrumentation
+import noise
 
 
 def main():
@@ -25,23 +27,48 @@ def main():
     parser.add_argument("--mValue", default="2", help="the scaling factor to use in the layerFunction. Must be greater than 1")
     parser.add_argument("--aProportion", default="0.5", help="the proportion of the privacy budget at each layer to give to the first count query.  Must be between 0 and 1.")
     parser.add_argument("--layerFunction", default="evenSplit", choices=id3.ID3Configuration.layerFunctions.keys(), help="the function to use which determines how much budget each layer gets")
+    parser.add_argument("--noiseMechanism", default="laplace", choices=noise.mechanisms.keys(), help="the mechanism that adds noise to the count queries")
+    parser.add_argument("-a", "--algorithm", nargs="+", default=["better_DP_ID3"], choices=experiments.algorithms.keys(), help="the training algorithms to run in every iteration")
+    parser.add_argument("--numTrees", type=int, default=10, help="the number of trees in a DP_forest, each trained on a disjoint part of the data")
+    parser.add_argument("--vote", default="majority", choices=forest.DPForest.votes, help="how the trees of a DP_forest are combined")
+    parser.add_argument("--forestWorkers", type=int, default=1, help="the number of processes to train the trees of a DP_forest in")
+    parser.add_argument("--treeWorkers", type=int, default=1, help="the number of threads or processes to build the subtrees of each ID3, DP_ID3 or better_DP_ID3 tree in")
+    parser.add_argument("--treeExecutor", default="thread", choices=["thread", "process"], help="whether --treeWorkers are threads or processes")
+    parser.add_argument("--workers", type=int, default=1, help="the number of processes to spread the iterations over")
+    parser.add_argument("--seed", type=int, default=None, help="the master seed for all random draws, so that a run can be reproduced")
+    splitGroup = parser.add_mutually_exclusive_group()
+    splitGroup.add_argument("--folds", type=int, default=None, help="evaluate with k-fold cross-validation over this many folds instead of on the training data")
+    splitGroup.add_argument("--testProportion", type=float, default=None, help="evaluate on this proportion of the rows, held out from training, instead of on the training data")
+    parser.add_argument("--countCache", type=int, default=None, metavar="PATHS", help="keep the exact counts of up to this many tree paths in each worker, so that better_DP_ID3 only draws fresh noise for paths that earlier iterations already counted")
+    parser.add_argument("--stats", action="store_true", help="record how the time and privacy budget of better_DP_ID3 training are spent, as extra output columns")
+    parser.add_argument("--compact", action="store_true", help="compact every ID3, DP_ID3 and better_DP_ID3 tree before it is evaluated or saved, with its node count and depth before and after as extra output columns")
+    parser.add_argument("--saveModels", default=None, metavar="DIRECTORY", help="save every trained model to this directory as <algorithm>-<iteration>.npz")
+    parser.add_argument("--scoreModels", nargs="+", default=None, metavar="MODEL", help="instead of training, evaluate these saved models on the dataset")
     args = parser.parse_args()
 
-    datasetConfig = datasets.choices[args.dataset]()
+    if args.scoreModels is not None:
+        csvRows = list(experiments.scoreModels(args.scoreModels, datasets.choices[args.dataset]()))
+        pd.DataFrame(csvRows, columns=experiments.scoreColumnNames).to_csv(args.outputFile)
+        return
+
+    # With folds, every algorithm has a row for each fold, and one for their mean if there is more than one fold.
+    rowsPerIteration = len(args.algorithm)
+    if args.folds is not None:
+        rowsPerIteration *= args.folds + (1 if args.folds > 1 else 0)
 
     csvRows = []
-    for i in range(args.numIterations):
-        paramConfig = id3.ID3Configuration(args)
-        model_better_dp_id3 = id3.better_DP_ID3(datasetConfig.dataframe, datasetConfig.attributeMap, datasetConfig.classColumn, datasetConfig.classes, 0, paramConfig)
-        accuracy = evaluation.calculateAccuracyOfDecisionTree(model_better_dp_id3, datasetConfig.dataframe, datasetConfig.classColumn)
-        macroF1Score, weightedF1Score = evaluation.calculateFScoreOfDecisionTree(model_better_dp_id3, datasetConfig.dataframe, datasetConfig.classColumn)
-        csvRows.append([paramConfig.maxDepth, paramConfig.epsilon, paramConfig.mValue, paramConfig.aProportion, paramConfig.layerFunction.__name__, accuracy, macroF1Score, weightedF1Score])
+    for i, csvRow in enumerate(experiments.runIterations(args)):
+        csvRows.append(csvRow)
 
-        if ((i+1) % 10 == 0):
-            print(f"Progress: {i+1}/{args.numIterations} iterations complete")
+        if ((i+1) % (10 * rowsPerIteration) == 0):
+            print(f"Progress: {(i+1) // rowsPerIteration}/{args.numIterations} iterations complete")
 
-    columnNames = ["maxDepth", "epsilon", "mValue", "aProportion", "layerFunction", "accuracy", "macroF1Score", "weightedF1Score"]
+    columnNames = experiments.columnNames + (instrumentation.TrainingStats.columnNames if args.stats else [])
+    columnNames = columnNames + (experiments.compactColumnNames if args.compact else [])
+    if args.folds is not None or args.testProportion is not None:
+        columnNames = columnNames + ["fold"]
     decisionTreeEvaluation = pd.DataFrame(csvRows, columns=columnNames)
     decisionTreeEvaluation.to_csv(args.outputFile)
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import numpy as np
+
+import forest
+import treenode
+
+# Saved models are .npz files (a zip of flat .npy arrays) that load without unpickling anything.
+# The arrays of a model with n trees are:
+#     formatVersion - the version of this layout, currently 1
+#     kind - "tree" for a single CompiledTree, "forest" for a DPForest
+#     vote - the vote of a forest
+#     attributes, classLabels - the attribute names and class labels of the encoding the trees use
+#     valueLabels, valueLabelCounts - the value labels of every attribute, one after another, and how many each attribute has
+#     classLabelMissing, valueLabelMissing - which of the class and value labels stand for missing values (NaN), which are
+#         stored as empty strings.  Files without them have none
+#     binnedAttributes, binEdges, binEdgeCounts - the numeric attributes, their bin edges one after another, and how many
+#         each has.  Files without them have no numeric attributes
+#     tree{i}_splitColumn, tree{i}_childTable, tree{i}_nodeClass, tree{i}_nodeCounts - the arrays of the i-th CompiledTree
+
+formatVersion = 1
+
+def _labelArrays(labels):
+    # Splits labels into strings and a mask of the missing ones, since a NaN label would otherwise be saved as "nan".
+    missing = np.array([ isinstance(label, float) and np.isnan(label) for label in labels ], dtype=bool)
+    return np.array([ "" if isMissing else label for label, isMissing in zip(labels, missing) ], dtype=str), missing
+
+def _labelList(strings, missing):
+    return [ np.nan if isMissing else label for label, isMissing in zip(strings.tolist(), missing) ]
+
+# NaN labels are not equal to each other, so they are all looked up by this key instead.
+_missingLabelKey = object()
+
+def _labelKey(label):
+    return _missingLabelKey if isinstance(label, float) and np.isnan(label) else label
+
+def saveModel(path, model, extraArrays=None):
+    '''
+    Write a trained model to a compact binary file.
+
+    Parameters:
+        path - The file to write.  numpy adds a .npz extension if it is missing
+        model - A CompiledTree or DPForest.  A TreeNode has to be compiled with treenode.compileTree first
+        extraArrays - Optionally, a dictionary of other arrays to store in the file.  loadModel ignores them
+    '''
+
+    if isinstance(model, forest.DPForest):
+        kind, vote, trees = "forest", model.vote, model.trees
+    else:
+        kind, vote, trees = "tree", "", [model]
+
+    labels = trees[0]
+    classLabels, classLabelMissing = _labelArrays(labels.classLabels)
+    valueLabels, valueLabelMissing = _labelArrays([ label for attribute in labels.attributes for label in labels.valueLabels[attribute] ])
+    arrays = {
+        "formatVersion": np.array(formatVersion),
+        "kind": np.array(kind),
+        "vote": np.array(vote),
+        "attributes": np.array(labels.attributes, dtype=str),
+        "classLabels": classLabels,
+        "classLabelMissing": classLabelMissing,
+        "valueLabels": valueLabels,
+        "valueLabelMissing": valueLabelMissing,
+        "valueLabelCounts": np.array([ len(labels.valueLabels[attribute]) for attribute in labels.attributes ], dtype=np.int64),
+        "binnedAttributes": np.array(list(labels.binEdges), dtype=str),
+        "binEdges": np.array([ edge for edges in labels.binEdges.values() for edge in edges ], dtype=np.float64),
+        "binEdgeCounts": np.array([ len(edges) for edges in labels.binEdges.values() ], dtype=np.int64),
+    }
+    for index, tree in enumerate(trees):
+        arrays[f"tree{index}_splitColumn"] = tree.splitColumn
+        arrays[f"tree{index}_childTable"] = tree.childTable
+        arrays[f"tree{index}_nodeClass"] = tree.nodeClass
+        arrays[f"tree{index}_nodeCounts"] = tree.nodeCounts
+    arrays.update(extraArrays or {})
+    np.savez_compressed(path, **arrays)
+
+def loadModel(path):
+    '''
+    Read a model written by saveModel straight into its prediction structure.
+
+    Parameters:
+        path - The .npz file to read
+    Returns:
+        A CompiledTree or DPForest, using the encoding it was saved with.  Use alignModel before predicting on a dataset
+    '''
+
+    with np.load(path, allow_pickle=False) as arrays:
+        version = int(arrays["formatVersion"])
+        if version != formatVersion:
+            raise ValueError(f"{path} uses model format version {version}, but only version {formatVersion} can be read")
+
+        attributes = arrays["attributes"].tolist()
+        classLabels = arrays["classLabels"].tolist()
+        allValueLabels = arrays["valueLabels"].tolist()
+        if "classLabelMissing" in arrays:
+            classLabels = _labelList(arrays["classLabels"], arrays["classLabelMissing"])
+            allValueLabels = _labelList(arrays["valueLabels"], arrays["valueLabelMissing"])
+        splitPoints = np.cumsum(arrays["valueLabelCounts"])
+        valueLabels = { attribute: allValueLabels[end - count:end] for attribute, count, end in zip(attributes, arrays["valueLabelCounts"], splitPoints) }
+        binEdges = {}
+        if "binnedAttributes" in arrays:
+            splitPoints = np.cumsum(arrays["binEdgeCounts"])[:-1]
+            binEdges = { attribute: edges.tolist() for attribute, edges in zip(arrays["binnedAttributes"].tolist(), np.split(arrays["binEdges"], splitPoints)) }
+
+        trees = []
+        while f"tree{len(trees)}_splitColumn" in arrays:
+            prefix = f"tree{len(trees)}_"
+            trees.append(treenode.CompiledTree(arrays[prefix + "splitColumn"], arrays[prefix + "childTable"], arrays[prefix + "nodeClass"],
+                                               arrays[prefix + "nodeCounts"], attributes, valueLabels, classLabels, binEdges))
+
+        if str(arrays["kind"]) == "forest":
+            return forest.DPForest(trees, str(arrays["vote"]))
+        return trees[0]
+
+def alignTree(tree, datasetConfig):
+    '''
+    Translate a CompiledTree to the column order, value codes and class codes of an encoded dataset.
+
+    Parameters:
+        tree - A CompiledTree, possibly trained on a different encoding of the same attributes
+        datasetConfig - The encoded DatasetConfiguration to predict on
+    Returns:
+        A CompiledTree whose predict_batch takes datasetConfig.matrix and returns codes into datasetConfig.classLabels
+    '''
+
+    if list(tree.attributes) == list(datasetConfig.attributes) and tree.valueLabels == datasetConfig.valueLabels \
+            and list(tree.classLabels) == list(datasetConfig.classLabels):
+        return tree
+
+    columnForAttribute = { attribute: column for column, attribute in enumerate(datasetConfig.attributes) }
+    codeForClass = { _labelKey(label): code for code, label in enumerate(datasetConfig.classLabels) }
+    for label in tree.classLabels:
+        if _labelKey(label) not in codeForClass:
+            raise ValueError(f"The model predicts the class {label!r}, which is not one of the dataset's classes")
+    for attribute in tree.attributes:
+        if attribute not in columnForAttribute:
+            raise ValueError(f"The model uses the attribute {attribute!r}, which is not in the dataset")
+
+    splitColumn = tree.splitColumn.copy()
+    tableWidth = max([ len(labels) for labels in datasetConfig.valueLabels.values() ], default=1)
+    childTable = np.full((len(splitColumn), max(tableWidth, 1)), -1, dtype=np.int32)
+    for modelColumn, attribute in enumerate(tree.attributes):
+        nodes = np.flatnonzero(tree.splitColumn == modelColumn)
+        splitColumn[nodes] = columnForAttribute[attribute]
+        datasetCodes = { _labelKey(label): code for code, label in enumerate(datasetConfig.valueLabels[attribute]) }
+        for modelCode, label in enumerate(tree.valueLabels[attribute]):
+            # Values the dataset has never seen cannot occur in its matrix, so they are dropped.
+            if _labelKey(label) in datasetCodes:
+                childTable[nodes, datasetCodes[_labelKey(label)]] = tree.childTable[nodes, modelCode]
+
+    classMap = np.array([ codeForClass[_labelKey(label)] for label in tree.classLabels ], dtype=np.int32)
+    nodeCounts = np.zeros((len(splitColumn), len(datasetConfig.classLabels)))
+    nodeCounts[:, classMap] = tree.nodeCounts
+    return treenode.CompiledTree(splitColumn, childTable, classMap[tree.nodeClass], nodeCounts,
+                                 list(datasetConfig.attributes), dict(datasetConfig.valueLabels), list(datasetConfig.classLabels),
+                                 dict(getattr(datasetConfig, "binEdges", {})))
+
+def alignModel(model, datasetConfig):
+    '''
+    Translate a loaded CompiledTree or DPForest to the encoding of a dataset (see alignTree).
+    '''
+    if isinstance(model, forest.DPForest):
+        return forest.DPForest([ alignTree(tree, datasetConfig) for tree in model.trees ], model.vote)
+    return alignTree(model, datasetConfig)
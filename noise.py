@@ -0,0 +1,64 @@
+import numpy as np
+
+# == noise sources ==
+# Every noise source has a sample(epsilons) method that takes an array with the privacy budget of each count query
+# (each with a sensitivity of 1) and returns an array of the same shape with the noise to add to each count.
+# A whole batch of queries is drawn with one vectorized call.
+# spawn(count) returns count new sources of the same kind whose random streams are independent of this one and each other.
+
+def _spawnGenerators(rng, count):
+    seedSequence = np.random.SeedSequence(int(rng.integers(2**63)))
+    return [ np.random.default_rng(childSeed) for childSeed in seedSequence.spawn(count) ]
+
+class LaplaceNoise:
+    '''
+    The Laplace mechanism: each count gets noise drawn from Laplace(0, 1/epsilon).
+    '''
+
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def sample(self, epsilons):
+        epsilons = np.asarray(epsilons, dtype=float)
+        return self.rng.laplace(0, 1/epsilons, size=epsilons.shape)
+
+    def spawn(self, count):
+        return [ LaplaceNoise(rng) for rng in _spawnGenerators(self.rng, count) ]
+
+class GeometricNoise:
+    '''
+    The geometric mechanism: each count gets two-sided geometric noise with parameter exp(-epsilon),
+    so noisy counts stay integers.
+    '''
+
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def sample(self, epsilons):
+        epsilons = np.asarray(epsilons, dtype=float)
+        # The difference of two geometric draws with success probability 1 - exp(-epsilon) is two-sided geometric.
+        p = -np.expm1(-epsilons)
+        return (self.rng.geometric(p, size=epsilons.shape) - self.rng.geometric(p, size=epsilons.shape)).astype(float)
+
+    def spawn(self, count):
+        return [ GeometricNoise(rng) for rng in _spawnGenerators(self.rng, count) ]
+
+class ConstantNoise:
+    '''
+    Adds the same fixed value to every count.  This makes training deterministic, which is useful for testing.
+    It gives no privacy.
+    '''
+
+    def __init__(self, value=0.0):
+        self.value = value
+
+    def sample(self, epsilons):
+        return np.full(np.shape(epsilons), self.value, dtype=float)
+
+    def spawn(self, count):
+        return [ ConstantNoise(self.value) for i in range(count) ]
+
+mechanisms = {
+    "laplace": LaplaceNoise,
+    "geometric": GeometricNoise
+}
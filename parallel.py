@@ -0,0 +1,137 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import copy
+
+import id3
+import instrumentation
+import shareddataset
+
+# The dataset used by _buildSubtreeTask in process workers, attached from a shareddataset.DatasetHandle when each worker starts.
+_datasetConfig = None
+
+def _initializeWorker(datasetHandle):
+    global _datasetConfig
+    _datasetConfig = datasetHandle.attach()
+
+def _buildSubtreeTask(task):
+    algorithm, rows, columns, depth, config = task
+    return id3.buildSubtree(algorithm, _datasetConfig, config, rows, columns, depth), None if config is None else config.stats
+
+class _SubtreeOffloader:
+    '''
+    Decides which subtrees of a tree being built by id3._buildTree are handed to a pool of workers.
+
+    A subtree is handed off when its node has between minTaskRows and taskRows rows.  Larger nodes are split further
+    by the main builder first, so that the tasks are small enough to balance over the workers, and smaller ones are not
+    worth the overhead of a task.  The decision only depends on the rows, so the same tree is built with any number of workers.
+    '''
+
+    def __init__(self, datasetConfig, config, algorithm, executor, processes, taskRows, minTaskRows):
+        self.datasetConfig = datasetConfig
+        self.config = config
+        self.algorithm = algorithm
+        self.executor = executor
+        self.processes = processes
+        self.taskRows = taskRows
+        self.minTaskRows = minTaskRows
+        self.taskStats = []
+
+    def __call__(self, rows, columns, depth):
+        if not self.minTaskRows <= len(rows) <= self.taskRows:
+            return None
+
+        # Each subtree draws its noise from its own stream, spawned in the order the builder reaches the subtrees.
+        taskConfig = None
+        if self.config is not None:
+            taskConfig = copy.copy(self.config)
+            taskConfig.noiseSource = self.config.noiseSource.spawn(1)[0]
+            taskConfig.stats = None if self.config.stats is None else instrumentation.TrainingStats()
+        if isinstance(rows, id3._PathRows):
+            # The rows are found here, since finding them partitions the rows of the parent, which other subtrees share.
+            rows.get()
+        if self.processes:
+            if isinstance(rows, id3._PathRows):
+                rows = rows.rows
+            if taskConfig is not None:
+                # Other processes cannot share the count cache of this one.
+                taskConfig.countCache = None
+        task = (self.algorithm, rows, columns, depth, taskConfig)
+
+        if self.executor is None:
+            # Without workers the subtree is built right away, with the same noise stream it would get in a worker.
+            future = Future()
+            future.set_result(self._build(task))
+        elif self.processes:
+            future = self.executor.submit(_buildSubtreeTask, task)
+        else:
+            future = self.executor.submit(self._build, task)
+        self.taskStats.append(future)
+        return _SubtreeResult(future)
+
+    def _build(self, task):
+        algorithm, rows, columns, depth, config = task
+        return id3.buildSubtree(algorithm, self.datasetConfig, config, rows, columns, depth), None if config is None else config.stats
+
+class _SubtreeResult:
+    # The subtree half of the (tree, stats) result of a task, as _buildTree expects.
+
+    def __init__(self, future):
+        self.future = future
+
+    def result(self):
+        return self.future.result()[0]
+
+def trainParallel(datasetConfig, config, algorithm="better_DP_ID3", workers=1, processes=False, taskRows=None, minTaskRows=1000, rows=None):
+    '''
+    Build a single tree with its subtrees spread over a pool of threads or processes.
+
+    The tree is built from a work queue.  Once a node has few enough rows (see taskRows), its whole subtree becomes one task
+    for the pool, and the finished subtrees are put back in place as the children of their parents.  Sibling subtrees
+    use disjoint rows and spend their privacy budgets independently, so this does not change the privacy of the tree.
+    Every task draws its noise from a stream spawned from config.noiseSource, so the trees differ from the ones of the
+    serial builders, but a given seed, taskRows and minTaskRows give the same tree with any number of workers.
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+        config - An ID3Configuration object.  It is not used by ID3
+        algorithm - "ID3", "DP_ID3" or "better_DP_ID3"
+        workers - The number of threads or processes.  With 1 worker every task is built in this thread
+        processes - If True, the tasks run in processes instead of threads.  The processes share the dataset through
+            shared memory (see shareddataset), and the tasks do not use config.countCache
+        taskRows - The largest number of rows of a node whose subtree becomes a task.  By default 1/16 of the rows
+        minTaskRows - The smallest number of rows of a node whose subtree becomes a task
+        rows - Optionally, the indices of the rows to train on.  All rows are used by default
+    Returns:
+        A TreeNode object containing a decision tree that classifies rows in the data
+    '''
+
+    columns = list(range(len(datasetConfig.attributes)))
+    if algorithm == "better_DP_ID3":
+        rootRows = id3._rootRows(datasetConfig, config, rows)
+    else:
+        rootRows = id3._trainingRows(datasetConfig, rows)
+    if taskRows is None:
+        taskRows = max(minTaskRows, len(rootRows) // 16)
+
+    executor = None
+    sharedDataset = None
+    if workers > 1 and processes:
+        sharedDataset = shareddataset.publishDataset(datasetConfig)
+        executor = ProcessPoolExecutor(workers, initializer=_initializeWorker, initargs=(sharedDataset.handle,))
+    elif workers > 1:
+        executor = ThreadPoolExecutor(workers)
+
+    offloader = _SubtreeOffloader(datasetConfig, config if algorithm != "ID3" else None, algorithm, executor, processes, taskRows, minTaskRows)
+    try:
+        tree = id3.buildSubtree(algorithm, datasetConfig, config, rootRows, columns, 0, offloader)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if sharedDataset is not None:
+            sharedDataset.close()
+
+    if config is not None and config.stats is not None:
+        for future in offloader.taskStats:
+            taskStats = future.result()[1]
+            if taskStats is not None:
+                config.stats.merge(taskStats)
+    return tree
@@ -0,0 +1,134 @@
+#===============================================================================
+# Hyperparameter search with successive halving.
+#
+# Samples candidate configurations of maxDepth, mValue, aProportion and
+# layerFunction, and trains a few trees for each.  After every round only the
+# best 1/eta of the candidates survive, and each survivor gets eta times as
+# many trees in total as in the round before.  Most of the trees are spent on
+# the candidates that are still in the running, instead of numIterations trees
+# on every candidate.  Every evaluation is written to the output CSV file.
+#===============================================================================
+import argparse
+import csv
+import math
+
+import numpy as np
+
+import datasets
+import experiments
+import id3
+
+searchColumnNames = ["round", "candidate", "iteration"] + experiments.columnNames
+
+def sampleCandidates(args, rng):
+    '''
+    Draws the configurations to search over.
+
+    Each parameter in args is a list of values to choose from, and a value of the form rand(a,b) is drawn
+    uniformly between a and b, as in ID3Configuration.processArg.
+
+    Parameters:
+        args - The parsed command line arguments of this script
+        rng - The numpy Generator to draw with
+    Returns:
+        A list of argparse.Namespace objects that IterationJob accepts as commandLineArgs, all with fixed values
+    '''
+    drawer = id3.ID3Configuration(rng=rng)
+    candidates = []
+    for i in range(args.numCandidates):
+        candidates.append(argparse.Namespace(
+            maxDepth=str(int(drawer.processArg(rng.choice(args.maxDepth)))),
+            epsilon=args.epsilon,
+            mValue=repr(drawer.processArg(rng.choice(args.mValue))),
+            aProportion=repr(drawer.processArg(rng.choice(args.aProportion))),
+            layerFunction=str(rng.choice(args.layerFunction)),
+            countCache=args.countCache,
+        ))
+    return candidates
+
+def successiveHalving(args, writeRow=None):
+    '''
+    Runs the search described at the top of this file.
+
+    Candidates are ranked by the mean accuracy of all of their trees so far.  The trees of a round are spread over
+    args.workers processes, and each tree is seeded from args.seed, the candidate and its iteration, so a search
+    gives the same results with any number of workers.
+
+    Parameters:
+        args - The parsed command line arguments of this script
+        writeRow - Optionally, a function that is called with each row of searchColumnNames as soon as it is evaluated
+    Returns:
+        A tuple (candidates, scores, numTrees, iterations), where candidates are the surviving candidates of the last round
+        from best to worst, scores are their mean accuracies, numTrees is the number of trees trained, and iterations
+        is the number of trees of each survivor
+    '''
+
+    rootSeedSequence = np.random.SeedSequence(args.seed)
+    candidates = sampleCandidates(args, np.random.default_rng(rootSeedSequence.spawn(1)[0]))
+    split = None
+    if args.testProportion is not None:
+        split = (int(rootSeedSequence.generate_state(1)[0]), None, args.testProportion)
+
+    accuracies = [ [] for candidate in candidates ]
+    survivors = list(range(len(candidates)))
+    iterations = args.minIterations
+    numTrees = 0
+    for roundIndex in range(args.maxRounds):
+        jobs = []
+        for candidate in survivors:
+            for iteration in range(len(accuracies[candidate]), iterations):
+                seedSequence = np.random.SeedSequence(rootSeedSequence.entropy, spawn_key=(1, candidate, iteration))
+                jobs.append(experiments.IterationJob(args.dataset, candidates[candidate], seedSequence, (candidate, iteration), args.algorithm, split=split))
+        for job, csvRow in experiments.runJobs(jobs, args.workers, ordered=False):
+            candidate, iteration = job.key
+            accuracies[candidate].append(csvRow[experiments.columnNames.index("accuracy")])
+            if writeRow is not None:
+                writeRow([roundIndex, candidate, iteration] + csvRow)
+        numTrees += len(jobs)
+
+        # Ties go to the candidate that was drawn first, so the ranking does not depend on the order jobs finish in.
+        survivors.sort(key=lambda candidate: (-np.mean(accuracies[candidate]), candidate))
+        if len(survivors) == 1 or roundIndex == args.maxRounds - 1:
+            break
+        survivors = survivors[:max(1, math.ceil(len(survivors) / args.eta))]
+        iterations *= args.eta
+
+    scores = [ float(np.mean(accuracies[candidate])) for candidate in survivors ]
+    return [ candidates[candidate] for candidate in survivors ], scores, numTrees, iterations
+
+def main():
+    parser = argparse.ArgumentParser(description="Search for the best training parameters with successive halving. Each parameter accepts several space separated values, and rand(a,b) draws a value between a and b.")
+    parser.add_argument("-d", "--dataset", default="mushroom", choices=datasets.choices.keys(), help="the dataset to use")
+    parser.add_argument("-a", "--algorithm", default="better_DP_ID3", choices=experiments.algorithms.keys(), help="the training algorithm to tune")
+    parser.add_argument("-o", "--outputFile", default="search.csv", help="the CSV file to write every evaluation to")
+    parser.add_argument("-c", "--numCandidates", type=int, default=27, help="the number of configurations to draw")
+    parser.add_argument("--eta", type=int, default=3, help="only the best 1/eta of the candidates survive each round, and survivors get eta times as many trees")
+    parser.add_argument("--minIterations", type=int, default=1, help="the number of trees each candidate gets in the first round")
+    parser.add_argument("--maxRounds", type=int, default=10, help="the largest number of rounds")
+    parser.add_argument("--maxDepth", nargs="+", default=["2", "3", "4", "5"], help="the maximum depths to choose from")
+    parser.add_argument("--epsilon", default="1", help="the privacy budget of each tree")
+    parser.add_argument("--mValue", nargs="+", default=["rand(1.1,4)"], help="the scaling factors of the layerFunction to choose from")
+    parser.add_argument("--aProportion", nargs="+", default=["rand(0.1,0.9)"], help="the proportions of the budget of each layer for the first count query to choose from")
+    parser.add_argument("--layerFunction", nargs="+", default=list(id3.ID3Configuration.layerFunctions.keys()), choices=id3.ID3Configuration.layerFunctions.keys(), help="the layer functions to choose from")
+    parser.add_argument("--testProportion", type=float, default=None, help="rank the candidates on this proportion of the rows, held out from training, instead of on the training data")
+    parser.add_argument("--workers", type=int, default=1, help="the number of processes to spread the trees of each round over")
+    parser.add_argument("--countCache", type=int, default=None, metavar="PATHS", help="keep the exact counts of up to this many tree paths in each worker")
+    parser.add_argument("--seed", type=int, default=None, help="the master seed for all random draws")
+    args = parser.parse_args()
+
+    with open(args.outputFile, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(searchColumnNames)
+
+        def writeRow(row):
+            writer.writerow(row)
+            file.flush()
+
+        candidates, scores, numTrees, iterations = successiveHalving(args, writeRow)
+
+    best = candidates[0]
+    print(f"Trained {numTrees} trees, instead of {args.numCandidates * iterations} for {iterations} trees on every candidate")
+    print(f"Best: maxDepth={best.maxDepth} mValue={best.mValue} aProportion={best.aProportion} layerFunction={best.layerFunction} accuracy={scores[0]:.4f}")
+
+if __name__ == "__main__":
+    main()
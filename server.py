@@ -0,0 +1,330 @@
+#===============================================================================
+# Local prediction server for saved models.
+#
+# Loads one or more models written by models.saveModel and answers prediction
+# requests over TCP, one JSON document per line.  Requests that arrive close
+# together are grouped into micro-batches, so each batch is classified by a
+# single predict_batch call on an integer-coded matrix.
+#
+# Each request line is one of:
+#     {"attribute": "value", ...}                  - a single record
+#     [{...}, {...}]                               - several records
+#     {"model": "name", "records": [{...}, ...]}   - records for a model other than the first one
+#     stats                                        - the latency and throughput counters, including
+#                                                    every request sent before it on the same connection
+# and each gets one response line, in the order the requests were sent:
+#     {"classes": ["label", ...]}  or  {"error": "message"}
+# A single record gets {"class": "label"} instead.  A line longer than the line
+# limit of the server is skipped and answered with an error.
+#===============================================================================
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import datasets
+import forest
+import models
+
+class ModelEncoder:
+    '''
+    Turns JSON records into the integer-coded matrix a loaded model predicts on, and class codes back into labels.
+
+    Values the model has never seen, and missing attributes, get a code that no tree has a child for,
+    so those rows stop at the node that splits on them and take its fallback class.  Numbers of the numeric attributes
+    of the model are put in their bins first, and anything else that is not the label of a bin is an error.
+    '''
+
+    def __init__(self, model):
+        trees = model.trees if isinstance(model, forest.DPForest) else [model]
+        self.model = model
+        self.attributes = list(trees[0].attributes)
+        self.codeMaps = [ { label: code for code, label in enumerate(trees[0].valueLabels[attribute]) } for attribute in self.attributes ]
+        self.classLabels = np.asarray(trees[0].classLabels, dtype=object)
+        self.unknownCode = max(tree.childTable.shape[1] for tree in trees)
+        self.binEdges = trees[0].binEdges
+
+    def encode(self, records):
+        '''
+        Parameters:
+            records - A list of dictionaries from attribute names to values
+        Returns:
+            An int32 matrix with one row per record and one column per attribute of the model
+        '''
+        for record in records:
+            if not isinstance(record, dict):
+                raise ValueError(f"A record must be a JSON object, not {type(record).__name__}")
+        matrix = np.empty((len(records), len(self.attributes)), dtype=np.int32)
+        for column, (attribute, codeMap) in enumerate(zip(self.attributes, self.codeMaps)):
+            values = [ record.get(attribute) for record in records ]
+            if attribute in self.binEdges:
+                values = datasets.binNumericValues(pd.Series(values, dtype=object, name=attribute), self.binEdges[attribute], list(codeMap)).tolist()
+            matrix[:, column] = [ codeMap.get(str(value), self.unknownCode) for value in values ]
+        return matrix
+
+    def predict(self, matrix):
+        return self.classLabels[self.model.predict_batch(matrix)]
+
+class LatencyStats:
+    '''
+    Counts the requests a server answered and keeps the latencies of the most recent ones.
+
+    requests, records, batches, errors - totals since the server started
+    latencies - the latencies of the last maxSamples requests in seconds
+    '''
+
+    def __init__(self, maxSamples=100000):
+        self.startTime = time.perf_counter()
+        self.requests = 0
+        self.records = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=maxSamples)
+
+    def summary(self):
+        '''
+        Returns the counters as a dictionary, with the p50 and p99 latencies in milliseconds and the
+        requests and records answered per second since the server started.
+        '''
+        elapsed = time.perf_counter() - self.startTime
+        latencies = np.array(self.latencies)
+        return {
+            "requests": self.requests,
+            "records": self.records,
+            "batches": self.batches,
+            "errors": self.errors,
+            "meanBatchRecords": self.records / self.batches if self.batches > 0 else None,
+            "p50LatencyMs": float(np.percentile(latencies, 50)) * 1000 if len(latencies) > 0 else None,
+            "p99LatencyMs": float(np.percentile(latencies, 99)) * 1000 if len(latencies) > 0 else None,
+            "requestsPerSecond": self.requests / elapsed,
+            "recordsPerSecond": self.records / elapsed,
+            "uptimeSeconds": elapsed,
+        }
+
+class MicroBatcher:
+    '''
+    Collects the requests for one model and classifies them together.
+
+    A batch is started by the first waiting request and closed when it holds maxBatchRecords records or
+    maxDelay seconds have passed, whichever comes first.  Under light load a request waits at most maxDelay,
+    and under heavy load the cost of each predict_batch call is shared by many requests.
+    '''
+
+    def __init__(self, encoder, stats, maxBatchRecords=4096, maxDelay=0.002):
+        self.encoder = encoder
+        self.stats = stats
+        self.maxBatchRecords = maxBatchRecords
+        self.maxDelay = maxDelay
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def predict(self, matrix):
+        '''
+        Classifies the rows of an encoded matrix as part of the next batch.
+
+        Returns:
+            An array with the class label of each row
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((matrix, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [ await self.queue.get() ]
+            numRecords = len(batch[0][0])
+            deadline = loop.time() + self.maxDelay
+            while numRecords < self.maxBatchRecords:
+                timeout = deadline - loop.time()
+                try:
+                    item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                batch.append(item)
+                numRecords += len(item[0])
+
+            try:
+                labels = self.encoder.predict(np.concatenate([ matrix for matrix, future in batch ]))
+            except Exception as error:
+                for matrix, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.stats.batches += 1
+            start = 0
+            for matrix, future in batch:
+                if not future.done():
+                    future.set_result(labels[start:start + len(matrix)])
+                start += len(matrix)
+
+class PredictionServer:
+    '''
+    Serves predictions of several loaded models over TCP, one JSON request per line (see the top of this file).
+
+    Parameters:
+        modelsByName - A dictionary from model names to loaded CompiledTree or DPForest models.  The first one is the default
+        maxBatchRecords, maxDelay - see MicroBatcher
+        lineLimit - The longest request line in bytes.  Longer lines are answered with an error
+    '''
+
+    def __init__(self, modelsByName, maxBatchRecords=4096, maxDelay=0.002, lineLimit=1 << 24):
+        if len(modelsByName) == 0:
+            raise ValueError("The server needs at least one model")
+        self.lineLimit = lineLimit
+        self.stats = LatencyStats()
+        self.defaultModel = next(iter(modelsByName))
+        self.batchers = { name: MicroBatcher(ModelEncoder(model), self.stats, maxBatchRecords, maxDelay) for name, model in modelsByName.items() }
+
+    async def predict(self, records, modelName=None):
+        '''
+        Classifies a list of records with a model, batched with any other requests in flight.
+
+        Returns:
+            A list with the class label of each record
+        '''
+        batcher = self.batchers.get(modelName or self.defaultModel)
+        if batcher is None:
+            raise ValueError(f"Unknown model {modelName!r}, expected one of {list(self.batchers)}")
+        labels = await batcher.predict(batcher.encoder.encode(records))
+        return labels.tolist()
+
+    async def answer(self, line, earlierTasks=()):
+        '''
+        Answers one request line and returns the response as a dictionary.
+        A stats request first waits for earlierTasks, the answers of the requests sent before it, so that it counts them.
+        '''
+        startTime = time.perf_counter()
+        if line.strip() == b"stats":
+            if len(earlierTasks) > 0:
+                await asyncio.wait(earlierTasks)
+            return self.stats.summary()
+        try:
+            request = json.loads(line)
+            single = False
+            if isinstance(request, dict) and isinstance(request.get("records"), list):
+                records, modelName = request["records"], request.get("model")
+            elif isinstance(request, list):
+                records, modelName = request, None
+            else:
+                records, modelName, single = [request], None, True
+            labels = await self.predict(records, modelName)
+        except Exception as error:
+            # A bad request only fails itself, never the connection or the server.
+            self.stats.errors += 1
+            return { "error": str(error) }
+
+        self.stats.requests += 1
+        self.stats.records += len(records)
+        self.stats.latencies.append(time.perf_counter() - startTime)
+        return { "class": labels[0] } if single else { "classes": labels }
+
+    async def handleConnection(self, reader, writer):
+        # Every line is answered in its own task so that pipelined requests share batches,
+        # and the responses are written in the order the requests came in.
+        responses = asyncio.Queue()
+
+        async def writeResponses():
+            while True:
+                task = await responses.get()
+                if task is None:
+                    break
+                writer.write(json.dumps(await task).encode() + b"\n")
+                await writer.drain()
+
+        loop = asyncio.get_running_loop()
+        writerTask = loop.create_task(writeResponses())
+        # The answers of this connection that are still being worked on.
+        unfinished = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as error:
+                    # The last line does not need to end with a newline.
+                    line = error.partial
+                except asyncio.LimitOverrunError as error:
+                    await _skipLine(reader, error.consumed)
+                    self.stats.errors += 1
+                    response = loop.create_future()
+                    response.set_result({ "error": f"The request is longer than the limit of {self.lineLimit} bytes" })
+                    await responses.put(response)
+                    continue
+                if not line:
+                    break
+                if line.strip():
+                    task = loop.create_task(self.answer(line, list(unfinished)))
+                    unfinished.add(task)
+                    task.add_done_callback(unfinished.discard)
+                    await responses.put(task)
+            await responses.put(None)
+            await writerTask
+        except ConnectionError:
+            pass
+        finally:
+            writerTask.cancel()
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, statsInterval=None):
+        '''
+        Answers connections until the server is stopped, printing the stats every statsInterval seconds if it is set.
+        '''
+        for batcher in self.batchers.values():
+            batcher.start()
+        server = await asyncio.start_server(self.handleConnection, host, port, limit=self.lineLimit)
+        print(f"Serving {list(self.batchers)} on {host}:{port}", file=sys.stderr)
+        async with server:
+            if statsInterval is None:
+                await server.serve_forever()
+            else:
+                serving = asyncio.get_running_loop().create_task(server.serve_forever())
+                while not serving.done():
+                    await asyncio.sleep(statsInterval)
+                    print(json.dumps(self.stats.summary()), file=sys.stderr)
+
+async def _skipLine(reader, consumed):
+    # Drops a line that is longer than the limit of the reader, a part at a time, after its first consumed bytes.
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b"\n")
+            return
+        except asyncio.IncompleteReadError:
+            return
+        except asyncio.LimitOverrunError as error:
+            consumed = error.consumed
+
+def loadModels(paths):
+    '''
+    Loads saved models, naming each one after its file without the extension.
+    '''
+    return { os.path.splitext(os.path.basename(path))[0]: models.loadModel(path) for path in paths }
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve predictions of saved models over TCP, one JSON request per line, batching concurrent requests.")
+    parser.add_argument("models", nargs="+", help="the saved models to serve.  Requests use the first one unless they name another")
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="the port to listen on")
+    parser.add_argument("--maxBatchRecords", type=int, default=4096, help="the largest number of records to classify in one batch")
+    parser.add_argument("--maxDelay", type=float, default=0.002, help="the longest time in seconds a request waits for its batch to fill")
+    parser.add_argument("--lineLimit", type=int, default=1 << 24, help="the longest request line in bytes.  Longer requests are answered with an error")
+    parser.add_argument("--statsInterval", type=float, default=None, help="print the latency and throughput counters every this many seconds")
+    args = parser.parse_args()
+
+    server = PredictionServer(loadModels(args.models), args.maxBatchRecords, args.maxDelay, args.lineLimit)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.statsInterval))
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats.summary()), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
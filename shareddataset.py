@@ -0,0 +1,108 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import datasets
+
+# Worker processes get a small DatasetHandle instead of a pickled DatasetConfiguration.  The parent copies the
+# matrix and classCodes of the encoded dataset into shared memory once, and each worker attaches to zero-copy views
+# of them, so a worker only holds its own copy of the labels no matter how many rows the dataset has.
+#
+#     with shareddataset.publishDataset(datasetConfig) as sharedDataset:
+#         executor = ProcessPoolExecutor(workers, initializer=..., initargs=(sharedDataset.handle,))
+#         ...
+#     # and in the worker:
+#     datasetConfig = handle.attach()
+
+class DatasetHandle:
+    '''
+    A small, picklable reference to a dataset published in shared memory.
+
+    arrays - a dictionary from "matrix" and "classCodes" to the (shared memory name, shape, dtype) of each array
+    metadata - the labels of the dataset, as returned by datasets.datasetMetadata
+    '''
+
+    def __init__(self, arrays, metadata):
+        self.arrays = arrays
+        self.metadata = metadata
+
+    def attach(self) -> datasets.DatasetConfiguration:
+        '''
+        Opens the shared dataset in this process.
+
+        Returns:
+            An encoded DatasetConfiguration whose matrix and classCodes are read-only views of the shared memory.
+            Its dataframe is only decoded from the codes when it is first used
+        '''
+        config = datasets.DatasetConfiguration()
+        config.dataframe = None
+        for name, value in self.metadata.items():
+            setattr(config, name, value)
+        # The blocks stay open as long as the configuration, since its arrays point into them.
+        config.sharedBlocks = []
+        for name, (blockName, shape, dtype) in self.arrays.items():
+            block = shared_memory.SharedMemory(name=blockName)
+            array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            array.flags.writeable = False
+            setattr(config, name, array)
+            config.sharedBlocks.append(block)
+        config.sharedHandle = self
+        return config
+
+class SharedDataset:
+    '''
+    The shared memory of a published dataset, owned by the process that published it (see publishDataset).
+    Close it once no worker needs the dataset any more, which the with statement does.
+
+    handle - the DatasetHandle to send to the workers
+    '''
+
+    def __init__(self, handle, blocks):
+        self.handle = handle
+        self.blocks = blocks
+
+    def close(self):
+        '''
+        Frees the shared memory.  Workers that are still attached keep their views until they let go of them.
+        '''
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exceptionInfo):
+        self.close()
+
+def publishDataset(datasetConfig) -> SharedDataset:
+    '''
+    Copies the arrays of an encoded dataset into shared memory.
+
+    A dataset that was itself attached from a handle is not copied again, and the SharedDataset returned for it
+    does not own any memory, so workers can hand the dataset on to their own workers for free.
+
+    Parameters:
+        datasetConfig - A DatasetConfiguration object whose encode() method has been called
+    Returns:
+        A SharedDataset whose handle workers can attach to
+    '''
+    handle = getattr(datasetConfig, "sharedHandle", None)
+    if handle is not None:
+        return SharedDataset(handle, [])
+
+    arrays = {}
+    blocks = []
+    try:
+        for name in ("matrix", "classCodes"):
+            array = np.asarray(getattr(datasetConfig, name))
+            # Shared memory cannot be empty, so an empty array still gets one byte.
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            arrays[name] = (block.name, array.shape, array.dtype.str)
+    except BaseException:
+        SharedDataset(None, blocks).close()
+        raise
+    return SharedDataset(DatasetHandle(arrays, datasets.datasetMetadata(datasetConfig)), blocks)
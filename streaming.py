@@ -0,0 +1,193 @@
+import argparse
+import contextlib
+import time
+
+import numpy as np
+import pandas as pd
+
+import datasets
+import id3
+import levelwise
+import models
+import noise
+import treenode
+
+def csvChunks(path, chunkSize, **readOptions):
+    '''
+    Makes a chunk reader for trainBetterDPID3Streaming that reads a CSV file as string dataframes.
+
+    Parameters:
+        path - The CSV file to read
+        chunkSize - The number of rows in each chunk
+        readOptions - Any other arguments of pandas.read_csv, such as names or sep
+    Returns:
+        A function with no parameters that starts a new pass over the file each time it is called
+    '''
+    return lambda: pd.read_csv(path, dtype=str, chunksize=chunkSize, **readOptions)
+
+def _readPass(readChunks):
+    # Yields the chunks of one pass over the data, and closes the reader afterwards, even when the pass stops early,
+    # so that its file is not left open.
+    chunks = readChunks()
+    try:
+        yield from chunks
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+class _LabelCounter:
+    '''
+    Counts how often each value of one column occurs with each class, adding new values as they are found.
+
+    labels - The values found so far.  The values passed to the constructor come first
+    counts - An array of shape (len(labels), number of class labels) with the counts
+    '''
+
+    def __init__(self, values):
+        self.labels = list(values)
+        self.codeForLabel = {}
+        for code, label in enumerate(self.labels):
+            self.codeForLabel.setdefault(label, code)
+        self.counts = np.zeros((len(self.labels), 0), dtype=np.int64)
+
+    def encode(self, column):
+        for label in pd.unique(column):
+            if label not in self.codeForLabel:
+                self.codeForLabel[label] = len(self.labels)
+                self.labels.append(label)
+        return column.map(self.codeForLabel).to_numpy(dtype=np.int64)
+
+    def add(self, codes, classCodes, numClassLabels):
+        shape = (len(self.labels), numClassLabels)
+        chunkCounts = np.bincount(codes * numClassLabels + classCodes, minlength=shape[0] * shape[1]).reshape(shape)
+        chunkCounts[:self.counts.shape[0], :self.counts.shape[1]] += self.counts
+        self.counts = chunkCounts
+
+def _scanRoot(readChunks, attributes, attributeMap, classColumn, classes):
+    # The first pass finds every value and class label in the data while counting the rows of the root node.
+    # The class column is counted as a column with a single value, so its counts are the class totals.
+    classCounter = _LabelCounter(classes)
+    classTotals = _LabelCounter([None])
+    valueCounters = { attribute: _LabelCounter(attributeMap.get(attribute, [])) for attribute in attributes }
+    for chunk in _readPass(readChunks):
+        classCodes = classCounter.encode(chunk[classColumn])
+        classTotals.add(np.zeros(len(chunk), dtype=np.int64), classCodes, len(classCounter.labels))
+        for attribute in attributes:
+            valueCounters[attribute].add(valueCounters[attribute].encode(chunk[attribute]), classCodes, len(classCounter.labels))
+    return classCounter, classTotals.counts, valueCounters
+
+def _encodeChunk(chunk, schema, codeMaps):
+    # Encodes a chunk with the labels found by the first pass.
+    matrix = np.empty((len(chunk), len(schema.attributes)), dtype=np.int64)
+    for column, attribute in enumerate(schema.attributes):
+        codes = chunk[attribute].map(codeMaps[attribute])
+        if codes.isna().any():
+            raise ValueError(f"The values of {attribute!r} changed between passes over the data")
+        matrix[:, column] = codes.to_numpy(dtype=np.int64)
+    classCodes = chunk[schema.classColumn].map(codeMaps[schema.classColumn])
+    if classCodes.isna().any():
+        raise ValueError(f"The values of {schema.classColumn!r} changed between passes over the data")
+    return matrix, classCodes.to_numpy(dtype=np.int64)
+
+def trainBetterDPID3Streaming(readChunks, classColumn, config, attributeMap=None, classes=None):
+    '''
+    Run better_DP_ID3 on data that is read in chunks and never held in memory all at once.
+
+    The tree is built one depth at a time like levelwise.trainBetterDPID3LevelWise, with one pass over the data
+    per depth.  Each pass sends every chunk down the part of the tree built so far and adds up the counts of the
+    frontier nodes, so memory is bounded by the chunk size plus the size of the tree.
+
+    Parameters:
+        readChunks - A function with no parameters that returns an iterable of pandas dataframes, starting a new pass
+            over the data each time it is called (see csvChunks)
+        classColumn - The name of the column that specifies the class value
+        config - An ID3Configuration object that contains the numerical parameters of the training
+        attributeMap - A dictionary with the attributes to use as keys and their possible values as values.
+            By default every column except classColumn is used, with the values found in the data
+        classes - The list of possible classes.  By default the classes found in the data are used
+    Returns:
+        A tuple (tree, schema) where tree is a TreeNode object, and schema is an encoded DatasetConfiguration
+        with no rows that holds the labels found in the data, for use with treenode.compileTree
+    '''
+
+    startTime = time.perf_counter()
+    if attributeMap is None:
+        with contextlib.closing(_readPass(readChunks)) as chunks:
+            firstChunk = next(chunks)
+        attributes = [ column for column in firstChunk.columns if column != classColumn ]
+    else:
+        attributes = list(attributeMap.keys())
+    classCounter, classTotals, valueCounters = _scanRoot(readChunks, attributes, attributeMap or {}, classColumn, classes or [])
+
+    schema = datasets.DatasetConfiguration()
+    schema.classColumn = classColumn
+    schema.attributes = attributes
+    schema.dataframeColumns = attributes + [classColumn]
+    schema.valueLabels = { attribute: valueCounters[attribute].labels for attribute in attributes }
+    schema.attributeMap = dict(attributeMap) if attributeMap is not None else dict(schema.valueLabels)
+    schema.classLabels = classCounter.labels
+    schema.classes = list(classes) if classes is not None else list(classCounter.labels)
+    schema.matrix = np.empty((0, len(attributes)), dtype=np.int64)
+    schema.classCodes = np.empty(0, dtype=np.int64)
+
+    builder = levelwise.LevelWiseBuilder(schema, config)
+    numClasses = len(schema.classes)
+
+    def classSlots(counts):
+        # Classes that are not in schema.classes share the last column, as in LevelWiseBuilder.countFrontier.
+        return np.concatenate((counts[:, :numClasses], counts[:, numClasses:].sum(axis=1, keepdims=True)), axis=1)
+
+    rootCounts = np.zeros((1, builder.totalLabels + 1, numClasses + 1), dtype=np.int64)
+    for column, attribute in enumerate(attributes):
+        offset = builder.labelOffsets[column]
+        rootCounts[0, offset:offset + builder.labelArities[column]] = classSlots(valueCounters[attribute].counts)
+    rootCounts[0, builder.totalLabels] = classSlots(classTotals)[0]
+    builder.expandFrontier(rootCounts)
+    levels = [ (builder.splitColumns, builder.routing) ]
+    if config.stats is not None:
+        config.stats.atDepth(0).seconds += time.perf_counter() - startTime
+
+    codeMaps = { attribute: valueCounters[attribute].codeForLabel for attribute in attributes }
+    codeMaps[classColumn] = classCounter.codeForLabel
+    while len(builder.frontier) > 0:
+        if config.stats is not None:
+            startTime = time.perf_counter()
+            depth = builder.depth
+        counts = np.zeros((len(builder.frontier), builder.totalLabels + 1, numClasses + 1), dtype=np.int64)
+        for chunk in _readPass(readChunks):
+            matrix, classCodes = _encodeChunk(chunk, schema, codeMaps)
+            nodeOfRow = np.zeros(len(matrix), dtype=np.int64)
+            for splitColumns, routing in levels:
+                nodeOfRow = levelwise.routeRows(splitColumns, routing, matrix, nodeOfRow)
+                stillActive = nodeOfRow >= 0
+                matrix, classCodes, nodeOfRow = matrix[stillActive], classCodes[stillActive], nodeOfRow[stillActive]
+            counts += builder.countFrontier(matrix, classCodes, nodeOfRow)
+        builder.expandFrontier(counts)
+        levels.append((builder.splitColumns, builder.routing))
+        if config.stats is not None:
+            config.stats.atDepth(depth).seconds += time.perf_counter() - startTime
+
+    return builder.root, schema
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a better_DP_ID3 tree on a CSV file that is too large to load, reading it in chunks with one pass per depth.")
+    parser.add_argument("inputFile", help="the CSV file to train on.  Its first line must name the columns")
+    parser.add_argument("-c", "--classColumn", required=True, help="the column that holds the class")
+    parser.add_argument("-o", "--outputFile", default="model.npz", help="the file to save the trained model to")
+    parser.add_argument("--chunkSize", type=int, default=100000, help="the number of rows to read at a time")
+    parser.add_argument("--maxDepth", default="4", help="the maximum depth the tree can grow to")
+    parser.add_argument("--epsilon", default="1", help="the privacy budget to use for the tree")
+    parser.add_argument("--mValue", default="2", help="the scaling factor to use in the layerFunction. Must be greater than 1")
+    parser.add_argument("--aProportion", default="0.5", help="the proportion of the privacy budget at each layer to give to the first count query.  Must be between 0 and 1.")
+    parser.add_argument("--layerFunction", default="evenSplit", choices=id3.ID3Configuration.layerFunctions.keys(), help="the function to use which determines how much budget each layer gets")
+    parser.add_argument("--noiseMechanism", default="laplace", choices=noise.mechanisms.keys(), help="the mechanism that adds noise to the count queries")
+    parser.add_argument("--seed", type=int, default=None, help="the seed for all random draws, so that a run can be reproduced")
+    args = parser.parse_args()
+
+    config = id3.ID3Configuration(args, np.random.default_rng(args.seed))
+    tree, schema = trainBetterDPID3Streaming(csvChunks(args.inputFile, args.chunkSize), args.classColumn, config)
+    models.saveModel(args.outputFile, treenode.compileTree(tree, schema))
+
+if __name__ == "__main__":
+    main()
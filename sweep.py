@@ -0,0 +1,111 @@
+#===============================================================================
+# Parameter sweeps for the differentially private ID3 experiments.
+#
+# Runs every combination of the given parameter values, streaming one CSV row per
+# trained tree to the output file.  Rerunning the same command skips the trees that
+# are already in the output file, so an interrupted sweep can be resumed.
+#===============================================================================
+import argparse
+import csv
+import itertools
+import os
+import zlib
+
+import numpy as np
+
+import datasets
+import experiments
+import id3
+
+sweepColumnNames = ["job", "dataset", "iteration"] + experiments.columnNames
+
+def jobKey(datasetName, algorithm, commandLineArgs, iteration):
+    '''
+    Builds the identifier of a sweep job from the parameter values as they were given on the command line.
+    '''
+    return "|".join([datasetName, algorithm, commandLineArgs.maxDepth, commandLineArgs.epsilon, commandLineArgs.mValue,
+                     commandLineArgs.aProportion, commandLineArgs.layerFunction, str(iteration)])
+
+def buildJobs(args):
+    '''
+    Creates an IterationJob for every combination of parameter values and every iteration.
+
+    Each job is seeded from the master seed and its own key, so a job produces the same row no matter
+    which other jobs are in the sweep.
+    '''
+    jobs = []
+    grid = itertools.product(args.dataset, args.algorithm, args.maxDepth, args.epsilon, args.mValue, args.aProportion, args.layerFunction)
+    for datasetName, algorithm, maxDepth, epsilon, mValue, aProportion, layerFunction in grid:
+        commandLineArgs = argparse.Namespace(maxDepth=maxDepth, epsilon=epsilon, mValue=mValue, aProportion=aProportion, layerFunction=layerFunction, countCache=args.countCache)
+        for iteration in range(args.numIterations):
+            key = jobKey(datasetName, algorithm, commandLineArgs, iteration)
+            if args.seed is None:
+                seedSequence = np.random.SeedSequence()
+            else:
+                seedSequence = np.random.SeedSequence(args.seed, spawn_key=(zlib.crc32(key.encode()),))
+            jobs.append(experiments.IterationJob(datasetName, commandLineArgs, seedSequence, key, algorithm))
+    return jobs
+
+def readCompletedJobs(outputFile):
+    '''
+    Returns the set of job keys that already have a row in outputFile.
+    '''
+    if not os.path.exists(outputFile) or os.path.getsize(outputFile) == 0:
+        return set()
+    with open(outputFile, newline="") as file:
+        reader = csv.DictReader(file)
+        if reader.fieldnames != sweepColumnNames:
+            raise ValueError(f"{outputFile} does not have the columns of a sweep output file, so it cannot be resumed")
+        return { row["job"] for row in reader }
+
+def dropPartialLastLine(outputFile):
+    '''
+    Removes a last row that a crash cut off in the middle of writing it.
+    '''
+    if not os.path.exists(outputFile) or os.path.getsize(outputFile) == 0:
+        return
+    with open(outputFile, "rb+") as file:
+        # Rows are short, so the last complete row always ends within the final block of the file.
+        tailStart = max(0, os.path.getsize(outputFile) - 65536)
+        file.seek(tailStart)
+        tail = file.read()
+        if not tail.endswith(b"\n"):
+            file.truncate(tailStart + tail.rfind(b"\n") + 1)
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run every combination of the given parameter values. Each parameter accepts several space separated values.")
+    parser.add_argument("-d", "--dataset", nargs="+", default=["mushroom"], choices=datasets.choices.keys(), help="the datasets to use")
+    parser.add_argument("-a", "--algorithm", nargs="+", default=["better_DP_ID3"], choices=experiments.algorithms.keys(), help="the training algorithms to use")
+    parser.add_argument("-n", "--numIterations", type=int, default=10, help="the number of decision trees to create and test for each combination")
+    parser.add_argument("-o", "--outputFile", default="sweep.csv", help="the CSV file to stream rows to.  Jobs that are already in it are skipped")
+    parser.add_argument("--maxDepth", nargs="+", default=["4"], help="the maximum depths the tree can grow to")
+    parser.add_argument("--epsilon", nargs="+", default=["1"], help="the privacy budgets to use for each tree")
+    parser.add_argument("--mValue", nargs="+", default=["2"], help="the scaling factors to use in the layerFunction. Must be greater than 1")
+    parser.add_argument("--aProportion", nargs="+", default=["0.5"], help="the proportions of the privacy budget at each layer to give to the first count query")
+    parser.add_argument("--layerFunction", nargs="+", default=["evenSplit"], choices=id3.ID3Configuration.layerFunctions.keys(), help="the functions which determine how much budget each layer gets")
+    parser.add_argument("--workers", type=int, default=1, help="the number of processes to spread the jobs over")
+    parser.add_argument("--countCache", type=int, default=None, metavar="PATHS", help="keep the exact counts of up to this many tree paths in each worker, shared by every job on the same dataset")
+    parser.add_argument("--seed", type=int, default=None, help="the master seed for all random draws")
+    args = parser.parse_args()
+
+    dropPartialLastLine(args.outputFile)
+    completedJobs = readCompletedJobs(args.outputFile)
+    jobs = [ job for job in buildJobs(args) if job.key not in completedJobs ]
+    print(f"{len(completedJobs)} jobs already complete, {len(jobs)} jobs to run")
+
+    writeHeader = len(completedJobs) == 0
+    with open(args.outputFile, "a" if not writeHeader else "w", newline="") as file:
+        writer = csv.writer(file)
+        if writeHeader:
+            writer.writerow(sweepColumnNames)
+        for i, (job, csvRow) in enumerate(experiments.runJobs(jobs, args.workers, ordered=False)):
+            iteration = job.key.rsplit("|", 1)[1]
+            writer.writerow([job.key, job.datasetName, iteration] + csvRow)
+            file.flush()
+
+            if ((i+1) % 10 == 0):
+                print(f"Progress: {i+1}/{len(jobs)} jobs complete")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+import datasets
+import id3
+import models
+import treenode
+
+def test_saved_model_keeps_missing_labels(tmp_path):
+    # Empty cells are read as NaN, so NaN is one of the value labels of both attributes.
+    rng = np.random.default_rng(0)
+    dataframe = pd.DataFrame({
+        "color": rng.choice(["red", "blue", None], 500),
+        "shape": rng.choice(["round", "square", None], 500),
+    })
+    dataframe["label"] = np.where(dataframe["color"].isna(), "missing", np.where(dataframe["shape"] == "round", "round", "other"))
+    datasetConfig = datasets.encodeDataframe(dataframe, {"color": ["red", "blue"], "shape": ["round", "square"]}, "label", ["missing", "round", "other"])
+    assert any(isinstance(label, float) and np.isnan(label) for label in datasetConfig.valueLabels["color"])
+
+    tree = treenode.compileTree(id3.trainID3(datasetConfig), datasetConfig)
+    models.saveModel(tmp_path / "model.npz", tree)
+    loaded = models.loadModel(tmp_path / "model.npz")
+    assert np.isnan(loaded.valueLabels["color"][-1])
+
+    loaded = models.alignModel(loaded, datasetConfig)
+    assert np.array_equal(loaded.predict_batch(datasetConfig.matrix), tree.predict_batch(datasetConfig.matrix))
+    assert np.array_equal(np.asarray(datasetConfig.classLabels)[loaded.predict_batch(datasetConfig.matrix)], dataframe["label"].to_numpy())
@@ -1,19 +1,32 @@
 import random
 
+import numpy as np
+
 #This class creates a tree structure data type
 class TreeNode:
-    def __init__(self, value):
+    # Trees can have millions of nodes, so they do not get a __dict__ each.
+    __slots__ = ("children", "data", "classCounts", "leafCount")
+
+    def __init__(self, value, classCounts=None, leafCount=1):
         self.children = {}
         self.data = value
+        # For leaves of the differentially private trees, the noisy count of each class (in the order of the dataset's classes)
+        # that the leaf's class was chosen from.  These counts were already released, so using them costs no extra budget.
+        self.classCounts = classCounts
+        # The number of leaves of the trained tree this leaf stands for, which is more than 1 after compactTree collapsed
+        # a subtree into it.  compileTree weighs the leaf by it when it picks the fallback classes of the nodes above.
+        self.leafCount = leafCount
 
     def __str__(self):
-        output = str(self.data) + ":\n"
-        for label, child in self.children.items():
-            # Add an extra tab before each child line so they get indented properly.
-            childContent = str(child).replace("\n\t", "\n\t\t")
-            output += "\t" + label + ": " + childContent
+        # Each child is on its own line below its parent, indented by one tab per level.
+        lines = [ str(self.data) + ":\n" ]
+        stack = [ (1, label, child) for label, child in reversed(self.children.items()) ]
+        while len(stack) > 0:
+            depth, label, node = stack.pop()
+            lines.append("\t" * depth + label + ": " + str(node.data) + ":\n")
+            stack.extend((depth + 1, childLabel, child) for childLabel, child in reversed(node.children.items()))
 
-        return output
+        return "".join(lines)
 
     def evaluate(self, row):
         '''
@@ -25,12 +38,219 @@ class TreeNode:
             The classification value output from the decision tree
         '''
 
-        isLeaf, value = self.data
+        node = self
+        isLeaf, value = node.data
+        while not isLeaf:
+            node = node.children[row[value]]
+            isLeaf, value = node.data
+        return value
+
+def treeShape(root):
+    '''
+    Measures a decision tree.
+
+    Parameters:
+        root - The TreeNode at the root of the decision tree
+    Returns:
+        A tuple (nodes, depth), where nodes is the number of distinct TreeNode objects, counting a node that is shared
+        by several parents (see compactTree) once, and depth is the length of the longest path from the root to a leaf
+    '''
+    seen = set()
+    depth = 0
+    stack = [ (root, 0) ]
+    while len(stack) > 0:
+        node, nodeDepth = stack.pop()
+        seen.add(id(node))
+        depth = max(depth, nodeDepth)
+        stack.extend((child, nodeDepth + 1) for child in node.children.values())
+    return len(seen), depth
+
+def compactTree(root, keepClassCounts=False):
+    '''
+    Makes a smaller decision tree that makes the same predictions.
+
+    Internal nodes whose children are all leaves of the same class become a single leaf of that class, starting
+    from the bottom so that whole subtrees collapse.  Leaves that are the same are then shared by all of their parents
+    instead of being separate objects.  The original tree is not changed.
+
+    A collapsed leaf records the number of leaves it replaced in leafCount, so the nodes above it keep the fallback class
+    compileTree gives them for rows with values they have no child for, and those rows are classified the same as well.
+
+    Parameters:
+        root - The TreeNode at the root of the decision tree
+        keepClassCounts - If False, the leaves do not keep their classCounts, so every leaf of a class is shared.
+            compileTree then gives each leaf a vote for its class for every leaf it replaced.  If True, a collapsed leaf
+            gets the sum of the classCounts of its children, and leaves are only shared when their classCounts are the same too
+    Returns:
+        The TreeNode at the root of the compacted tree.  Use treeShape to compare the sizes of the two trees
+    '''
+
+    sharedLeaves = {}
+
+    def leaf(data, classCounts, leafCount):
+        if not keepClassCounts:
+            classCounts = None
+        key = (data, None if classCounts is None else tuple(np.asarray(classCounts).tolist()), leafCount)
+        if key not in sharedLeaves:
+            sharedLeaves[key] = TreeNode(data, classCounts, leafCount)
+        return sharedLeaves[key]
+
+    # The nodes are compacted children first, with an explicit stack so that deep trees cannot hit the recursion limit.
+    compacted = {}
+    stack = [ (root, False) ]
+    while len(stack) > 0:
+        node, childrenDone = stack.pop()
+        if id(node) in compacted:
+            continue
+        if len(node.children) == 0:
+            compacted[id(node)] = leaf(node.data, node.classCounts, node.leafCount)
+            continue
+        if not childrenDone:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children.values())
+            continue
+
+        children = { label: compacted[id(child)] for label, child in node.children.items() }
+        firstChild = next(iter(children.values()))
+        if all(len(child.children) == 0 and child.data == firstChild.data for child in children.values()):
+            classCounts = None
+            if keepClassCounts and all(child.classCounts is not None for child in children.values()):
+                classCounts = sum(np.asarray(child.classCounts) for child in children.values())
+            compacted[id(node)] = leaf(firstChild.data, classCounts, sum(child.leafCount for child in children.values()))
+        else:
+            newNode = TreeNode(node.data)
+            newNode.children = children
+            compacted[id(node)] = newNode
+    return compacted[id(root)]
+
+class CompiledTree:
+    '''
+    A decision tree flattened into arrays so that a whole matrix of integer-coded rows can be classified at once.
+
+    Nodes are numbered breadth-first with the root at 0.  For node i:
+        splitColumn[i] - the matrix column node i splits on, or -1 if node i is a leaf
+        childTable[i, code] - the child of node i for rows whose split column has that value code, or -1 if there is none
+        nodeClass[i] - the class code predicted by a leaf.  For an internal node this is the most common leaf class below it,
+            counting each leaf leafCount times, which is used for rows that have a value the node has no child for.
+        nodeCounts[i, c] - the class counts of a leaf (its classCounts, or leafCount votes for its class if it has none).
+            For an internal node this is the sum over the leaves below it.
+    binEdges holds the bin edges of the numeric attributes of the encoding (see datasets.binNumericColumn), so that
+    raw numbers can be encoded for the tree.
+    '''
+
+    def __init__(self, splitColumn, childTable, nodeClass, nodeCounts, attributes, valueLabels, classLabels, binEdges=None):
+        self.splitColumn = splitColumn
+        self.childTable = childTable
+        self.nodeClass = nodeClass
+        self.nodeCounts = nodeCounts
+        self.attributes = attributes
+        self.valueLabels = valueLabels
+        self.classLabels = classLabels
+        self.binEdges = binEdges if binEdges is not None else {}
+
+    def leafIndices(self, matrix):
+        '''
+        Finds the node each row ends up at by advancing all rows one level at a time.
+
+        Parameters:
+            matrix - A 2D integer array of value codes with the same columns as the matrix the tree was compiled for
+        Returns:
+            A 1D array containing the index of the final node of each row
+        '''
+
+        nodes = np.zeros(len(matrix), dtype=np.int32)
+        tableWidth = self.childTable.shape[1]
+        active = np.flatnonzero(self.splitColumn[nodes] >= 0)
+        while len(active) > 0:
+            current = nodes[active]
+            codes = matrix[active, self.splitColumn[current]].astype(np.int64)
+            knownCodes = codes < tableWidth
+            nextNodes = np.where(knownCodes, self.childTable[current, np.where(knownCodes, codes, 0)], -1)
+            # Rows without a matching child stop where they are and take the fallback class of that node.
+            moved = nextNodes >= 0
+            active = active[moved]
+            nodes[active] = nextNodes[moved]
+            active = active[self.splitColumn[nodes[active]] >= 0]
+        return nodes
+
+    def predict_batch(self, matrix):
+        '''
+        Classifies every row of an integer-coded matrix.
+
+        Parameters:
+            matrix - A 2D integer array of value codes with the same columns as the matrix the tree was compiled for
+        Returns:
+            A 1D array with the predicted class code of each row.  The codes index into classLabels.
+        '''
+        return self.nodeClass[self.leafIndices(matrix)]
+
+    def predictLabels(self, matrix):
+        '''
+        Classifies every row of an integer-coded matrix and returns the class labels instead of class codes.
+        '''
+        return np.asarray(self.classLabels, dtype=object)[self.predict_batch(matrix)]
+
+def compileTree(root, datasetConfig):
+    '''
+    Flattens a trained decision tree into a CompiledTree.
+
+    Parameters:
+        root - The TreeNode at the root of the decision tree
+        datasetConfig - An encoded DatasetConfiguration whose attribute, value and class labels the tree was trained with
+    Returns:
+        A CompiledTree object that makes the same predictions as the TreeNode
+    '''
+
+    attributes = list(datasetConfig.attributes)
+    columnForAttribute = { attribute: column for column, attribute in enumerate(attributes) }
+    codeForValue = { attribute: { label: code for code, label in enumerate(labels) } for attribute, labels in datasetConfig.valueLabels.items() }
+    codeForClass = { label: code for code, label in enumerate(datasetConfig.classLabels) }
+
+    # Number the nodes breadth-first so that every parent comes before its children.
+    nodes = [root]
+    parents = [-1]
+    position = 0
+    while position < len(nodes):
+        node = nodes[position]
+        for child in node.children.values():
+            nodes.append(child)
+            parents.append(position)
+        position += 1
+
+    tableWidth = max([ len(labels) for labels in datasetConfig.valueLabels.values() ], default=0)
+    splitColumn = np.full(len(nodes), -1, dtype=np.int32)
+    childTable = np.full((len(nodes), max(tableWidth, 1)), -1, dtype=np.int32)
+    nodeClass = np.zeros(len(nodes), dtype=np.int32)
+    leafClassCounts = np.zeros((len(nodes), len(datasetConfig.classLabels)), dtype=np.int64)
+    nodeCounts = np.zeros((len(nodes), len(datasetConfig.classLabels)))
+
+    nextChild = 1
+    for index, node in enumerate(nodes):
+        isLeaf, value = node.data
         if isLeaf:
-            return value
+            if value not in codeForClass:
+                raise ValueError(f"The tree predicts the class {value!r}, which is not one of the dataset's classes")
+            nodeClass[index] = codeForClass[value]
+            leafClassCounts[index, codeForClass[value]] = node.leafCount
+            if node.classCounts is not None:
+                nodeCounts[index, :len(node.classCounts)] = node.classCounts
+            else:
+                nodeCounts[index, codeForClass[value]] = node.leafCount
         else:
-            attributeValue = row[value]
-            return self.children[attributeValue].evaluate(row)
+            splitColumn[index] = columnForAttribute[value]
+            for label in node.children:
+                childTable[index, codeForValue[value][label]] = nextChild
+                nextChild += 1
+
+    # Children always come after their parents, so walking backwards sums every subtree before it is needed.
+    for index in range(len(nodes) - 1, 0, -1):
+        leafClassCounts[parents[index]] += leafClassCounts[index]
+        nodeCounts[parents[index]] += nodeCounts[index]
+    isInternal = splitColumn >= 0
+    nodeClass[isInternal] = np.argmax(leafClassCounts[isInternal], axis=1)
+
+    return CompiledTree(splitColumn, childTable, nodeClass, nodeCounts, attributes, dict(datasetConfig.valueLabels), list(datasetConfig.classLabels),
+                        dict(getattr(datasetConfig, "binEdges", {})))
 
 class RandomGuesser:
     def __init__(self, dataframe, classColumn):